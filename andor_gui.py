@@ -1,14 +1,21 @@
+import time
+# Startup is timed from here, see MainWindow.markStartup
+startTime = time.time()
+
 from PyQt4 import QtGui, QtCore, Qt
 from PyQt4.QtCore import pyqtSignal
 from numpy.core.fromnumeric import reshape
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, CancelledError
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
 import twisted.internet.error
 
-import time
 import os
+import argparse
 
 import numpy as np
 from copy import deepcopy
+from collections import OrderedDict
 
 import json
 
@@ -16,10 +23,18 @@ import sys
 sys.path.append("./lib/")
 sys.path.append("./lib/sdk2/")
 
+# The camera backend is picked when andor_class is imported, so --simulate is looked at before the imports
+if '--simulate' in sys.argv:
+	os.environ['KRBCAM_SIMULATE'] = '1'
+
 # Our helper files
 from gui_helpers import *
 from andor_helpers import *
 from andor_class import KRbiXon
+from shot_writer import ShotWriter, writeNpz, writeNpy, writeCsv
+from shot_processor import ShotProcessor
+from shot_metrics import ShotMetrics
+from image_processing import rotateFrames
 
 import qtreactor.pyqt4reactor
 qtreactor.pyqt4reactor.install()
@@ -42,7 +57,7 @@ class CameraSelect(QtGui.QDialog):
 		self.serials = serials
 		self.realIndex = realindex
 
-		self.lookup = KRBCAM_SERIALS
+		self.lookup = getSerials()
 
 		self.populate()
 
@@ -78,7 +93,7 @@ class CameraSelect(QtGui.QDialog):
 class MainWindow(QtGui.QWidget):
 	# Dictionary for holding camera configuration
 	# from GUI form input
-	gConfig = default_config
+	gConfig = {}
 
 	# Camera parameters
 	gCamInfo = {}
@@ -92,6 +107,18 @@ class MainWindow(QtGui.QWidget):
 	else:
 		gFlagLoop = KRBCAM_LOOP_ACQ
 
+	# Wait for the end of each acquisition in a worker thread
+	# instead of polling the camera status
+	gFlagWait = KRBCAM_ACQ_WAIT
+
+	# Streaming single images in Run till Abort?
+	# Set in setupAcquisition from the config form
+	gFlagStream = False
+
+	# Is the SDK rotating the images for us?
+	# Set in setupAcquisition; if not, rotated images are rotated lazily for display and saving
+	gFlagSDKRotate = False
+
 	# Counter for number of shots in OD series
 	gAcqLoopCounter = 0
 
@@ -111,59 +138,125 @@ class MainWindow(QtGui.QWidget):
 		yield self.cxn.connect()
 		self.alerter = yield self.cxn.get_server('polarkrb_alerter')
 
-	def __init__(self, reactor):
+	# rescanCameras: initialize every camera to read its serial number,
+	# instead of using the serial numbers cached from the last run
+	# refreshCaps: read the camera capabilities from the camera, instead of the capability cache
+	# cameraIndex: index of the camera to use, instead of asking with the camera select dialog
+	# metrics: time the stages of every shot, see ShotMetrics
+	def __init__(self, reactor, rescanCameras=False, refreshCaps=False, cameraIndex=None, metrics=KRBCAM_METRICS):
 		super(MainWindow, self).__init__(None)
 		self.reactor = reactor
+		self.refreshCaps = refreshCaps
+
+		# Time taken by each phase of starting up, in seconds
+		self.startupTimes = OrderedDict()
+		self.startupMark = startTime
+		self.markStartup('imports')
+
 		self.setFixedSize(layout_params['main'][0],layout_params['main'][1])
 		self.populate()
+		self.gConfig = getDefaultConfig()
+		self.markStartup('widgets')
 
 		self.timedOut = False
 
+		# Dedicated thread for blocking on WaitForAcquisitionTimeOut
+		# The thread is stopped when the reactor shuts down
+		self.acqThreadPool = ThreadPool(1, 1, "KRbCamAcquisition")
+		self.acqThreadPool.start()
+		self.reactor.addSystemEventTrigger('during', 'shutdown', self.acqThreadPool.stop)
+
+		# Writes saved shots in the background
+		self.writer = ShotWriter(self.reactor)
+
+		# Rotates shots and calculates ODs for display in the background
+		self.processor = ShotProcessor(self.reactor)
+		self.markStartup('threads')
+
+		# Stage timings of each shot, logged next to the data
+		self.metrics = ShotMetrics(self.reactor, metrics, self.configForm.fileNumbers)
+		self.acquireStart = None
+
 		try:
 			self.setupLabRAD()
 		except Exception as e:
 			self.cxn = None
 			print("Could not connect to LabRAD : {}".format(e))
+		self.markStartup('LabRAD')
 			
 		# Get list of serial numbers of connected cameras
-		serials = self.initializeSDK()
-		if serials:
+		serials = self.initializeSDK(not rescanCameras)
+		self.markStartup('SDK')
 
+		# Ask which camera to use, unless we were told
+		# A camera that turns out to be in use is left out and the dialog is shown again
+		askUser = cameraIndex is None
+		while serials:
 			# When an instance of the SDK is already talking to a camera,
 			# the serial number is 0. So clean these unavailable cameras away:
 			realindex = []
 			serials_nonzero = []
 			for i, s in enumerate(serials):
-				if s and KRBCAM_SERIALS.has_key(str(s)):
+				if s and getSerials().has_key(str(s)):
 					serials_nonzero.append(s)
 					realindex.append(i)
 
 			# Check if any nonzero serials:
 			if not len(serials_nonzero):
 				self.throwErrorMessage("No available cameras! Please close the GUI.", "")
-			else:
+				break
+
+			if askUser:
 				# Open the dialog:
 				self.dialog = CameraSelect(serials_nonzero, realindex)
 
 				# Dialog accepted
+				cameraIndex = None
 				if self.dialog.exec_():
 					cameraIndex = self.dialog.getSelected()
-					(errf, errm) = self.selectCamera(cameraIndex)
 
-					if errf:
-						self.throwErrorMessage("SDK initialization error! Try to restart the GUI.", errm)
-					else:
-						self.gCameraSerial = serials[cameraIndex]
-						cameraName = str(self.gCameraSerial) + ": " + KRBCAM_SERIALS[str(self.gCameraSerial)]
-						self.configForm.cameraNameStatic.setText(cameraName)
+				# Don't count the time spent in the dialog
+				self.startupMark = time.time()
 
-						self.setupCamera()
-				else:
-					self.throwErrorMessage("No camera selected! Restart the GUI.", "")
+			if cameraIndex is None:
+				self.throwErrorMessage("No camera selected! Restart the GUI.", "")
+				break
 
-	def initializeSDK(self):
+			(errf, errm, cameraIndex, serials) = self.selectCamera(cameraIndex, serials)
+			self.markStartup('camera select')
+
+			# The camera is in use, its serial number is now 0
+			if cameraIndex is None:
+				self.appendToStatus(errm)
+				if askUser:
+					continue
+				self.throwErrorMessage("Camera in use!", errm)
+			elif errf:
+				self.throwErrorMessage("SDK initialization error! Try to restart the GUI.", errm)
+			else:
+				self.gCameraSerial = serials[cameraIndex]
+				cameraName = str(self.gCameraSerial) + ": " + getSerials()[str(self.gCameraSerial)]
+				self.configForm.cameraNameStatic.setText(cameraName)
+
+				self.setupCamera()
+				self.markStartup('camera setup')
+				self.reportStartup()
+			break
+
+	# Record the time since the last mark as the duration of phase
+	def markStartup(self, phase):
+		now = time.time()
+		self.startupTimes[phase] = now - self.startupMark
+		self.startupMark = now
+
+	def reportStartup(self):
+		phases = ", ".join("{} {:.0f} ms".format(phase, 1000*t) for (phase, t) in self.startupTimes.items())
+		total = sum(self.startupTimes.values())
+		self.appendToStatus("Started up in {:.0f} ms ({}).\n".format(1000*total, phases))
+
+	def initializeSDK(self, useCache=True):
 		self.AndorCamera = KRbiXon()
-		(errf, serials, errm) = self.AndorCamera.initializeSDK()
+		(errf, serials, errm) = self.AndorCamera.initializeSDK(useCache)
 
 		# If an error, raise warnings, stop the camera, and close the window
 		if errf:
@@ -173,10 +266,45 @@ class MainWindow(QtGui.QWidget):
 			self.appendToStatus(errm)
 			return serials
 
-	def selectCamera(self, index):
+	# Select and initialize the camera at index, whose serial number should be serials[index]
+	# If the serial numbers came from the camera cache, the camera wasn't probed on startup:
+	# - if it is in use by another instance of the SDK (it fails to initialize, or its serial
+	#   number reads 0, same as when probing), its serial number is set to 0 and the index is None
+	# - if it turns out to be a different camera, all cameras are probed again
+	#   and the camera with the right serial number is selected
+	# Returns (error flag, message, index, serials), with the index and serials after any re-probe
+	def selectCamera(self, index, serials):
 		(errf0, errm0) = self.AndorCamera.selectCamera(index)
 		(errf1, errm1) = self.AndorCamera.initializeCamera()
-		return (errf0 or errf1, errm0 + errm1)
+		(errf, errm) = (errf0 or errf1, errm0 + errm1)
+
+		serial = serials[index]
+		if self.AndorCamera.serialsFromCache:
+			actual = 0
+			if not errf1:
+				actual = self.AndorCamera.readCameraSerial()
+
+			if not actual:
+				if not errf1:
+					self.AndorCamera.ShutDown()
+				serials = list(serials)
+				serials[index] = 0
+				return (1, errm + "Camera {} is in use.\n".format(serial), None, serials)
+
+			if actual != serial:
+				self.appendToStatus("Camera cache is out of date, probing all cameras.\n")
+				self.AndorCamera.ShutDown()
+
+				(errf, serials, errm) = self.AndorCamera.initializeSDK(False)
+				if errf or serial not in serials:
+					return (1, errm + "Camera {} not found.\n".format(serial), index, serials)
+
+				index = serials.index(serial)
+				(errf0, errm0) = self.AndorCamera.selectCamera(index)
+				(errf1, errm1) = self.AndorCamera.initializeCamera()
+				(errf, errm) = (errf0 or errf1, errm + errm0 + errm1)
+
+		return (errf, errm, index, serials)
 
 	# Initialize the Andor SDK using our KRbFastKinetics() class built on the atmcd.py python wrapper
 	def setupCamera(self):
@@ -184,14 +312,21 @@ class MainWindow(QtGui.QWidget):
 		self.gConfig = self.configForm.getFormData()
 		self.acquireAbortStatus.acquireControl.setDisabled(True)
 
-		self.AndorCamera.setupCamera()
+		start = time.time()
+		(errf, errm) = self.AndorCamera.setupCamera(self.gCameraSerial, self.refreshCaps)
+		if errf:
+			self.appendToStatus(errm)
+		elif self.AndorCamera.capsFromCache:
+			self.appendToStatus("Camera capabilities loaded from cache in {:.0f} ms.\n".format(1000*(time.time() - start)))
+		else:
+			self.appendToStatus("Camera capabilities read from camera in {:.1f} s.\n".format(time.time() - start))
 		self.gCamInfo = self.AndorCamera.camInfo
 
 		# Set up vertical shift speed control, pre amp gain, adc channel
 		self.configForm.setupComboBoxes(self.gCamInfo)
 
 		# Auto set config for vertical
-		if KRBCAM_SERIALS[str(self.gCameraSerial)] == "vertical":
+		if getSerials()[str(self.gCameraSerial)] == "vertical":
 			with open('./lib/config/' + KRBCAM_DEFAULT_CONFIG_VERTICAL) as f:
 				config = json.load(f)
 			self.configForm.setDefaultValues(config)
@@ -242,7 +377,7 @@ class MainWindow(QtGui.QWidget):
 		# Populate vertical shift speeds
 		for val in self.gCamInfo['vss']:
 			self.configForm.vssControl.addItem("{:.2} usec".format(val))
-		self.configForm.vssControl.setCurrentIndex(default_config['vss'])
+		self.configForm.vssControl.setCurrentIndex(getDefaultConfig()['vss'])
 
 
 	# Turn on cooler
@@ -394,10 +529,21 @@ class MainWindow(QtGui.QWidget):
 			return 0
 		
 	# Setup acquisition
+	# Re-arms in the acquisition loop (flagVerbose False) only send the settings
+	# that changed; starting from the acquire button sends all of them
 	def setupAcquisition(self, flagVerbose=True):
 		# Cancel timeout
 		self.cancelTimeout()
 
+		# Each acquisition loop is timed as one shot, starting with arming the camera
+		self.metrics.beginShot()
+		arm = self.metrics.start()
+		if flagVerbose and self.metrics.enabled:
+			self.appendToStatus("Timing shots, see {} in the save folder.\n".format(KRBCAM_METRICS_LOG_FILE))
+
+		if flagVerbose:
+			self.AndorCamera.resetAppliedState()
+
 		# armiXon sets the basic acquisition details
 		# e.g., acquisition mode, read mode, shutter mode, trigger mode, em gain mode
 		(errf, errm) = self.AndorCamera.armiXon()
@@ -425,6 +571,12 @@ class MainWindow(QtGui.QWidget):
 		self.gFKSeriesLength = self.gConfig['kinFrames']
 		self.gAcqLoopLength = self.gConfig['acqLength']
 
+		# Stream with Run till Abort if requested
+		# Fast kinetics series can't be streamed, and streaming only makes sense
+		# when the external trigger paces the acquisition loop
+		self.gFlagStream = self.gConfig['stream'] and self.gAcqMode == KRBCAM_ACQ_MODE_SINGLE and self.gFlagLoop
+		if self.gConfig['stream'] and not self.gFlagStream and flagVerbose:
+			self.appendToStatus("Streaming needs single images and an external trigger. Re-arming for every shot instead.\n")
 
 		# setupAcquisition sets the EM settings, ad channel, shift speeds, pre amp settings
 		(errf, errm) = self.AndorCamera.setupAcquisition(self.gConfig)
@@ -444,6 +596,15 @@ class MainWindow(QtGui.QWidget):
 				return -2
 			elif flagVerbose:
 				self.appendToStatus(errm)
+		elif self.gFlagStream:
+			# setupStreaming arms Run till Abort, the camera then stays armed between shots
+			(errf, errm) = self.AndorCamera.setupStreaming(self.gConfig)
+
+			if errf:
+				self.throwErrorMessage("KRbiXon.setupStreaming error!", errm)
+				return -2
+			elif flagVerbose:
+				self.appendToStatus(errm)
 		elif self.gAcqMode == KRBCAM_ACQ_MODE_SINGLE:
 			# setupAcquisition sets the EM settings, ad channel, shift speeds, pre amp settings
 			(errf, errm) = self.AndorCamera.setupImage(self.gConfig)
@@ -454,33 +615,122 @@ class MainWindow(QtGui.QWidget):
 			elif flagVerbose:
 				self.appendToStatus(errm)
 
+		# Rotate the images in the SDK if we can
+		self.gFlagSDKRotate = self.AndorCamera.setupRotation(self.gConfig['rotateImage'])
+		if flagVerbose and self.gConfig['rotateImage']:
+			if self.gFlagSDKRotate:
+				self.appendToStatus("Images rotated by the SDK.\n")
+			else:
+				self.appendToStatus("Images rotated for display and saving.\n")
+
+		self.metrics.stop('arm', arm)
+
 		# Enable abort button, disable acquire button
 		self.acquireAbortStatus.acquire()
+		self.imageWindow.setLive(True)
 
 		# Reset OD series counter
 		self.gAcqLoopCounter = 0
 
 		# Start acquiring data!
-		# dataArray is passed between startAcquisition and checkForData methods
-		# to hold data
-		# Hopefully this does not result in memory leaks...?
-		dataArray = []
-		self.startAcquisition(dataArray)
+		# The run buffer is passed between startAcquisition and checkForData methods
+		# to hold data; each shot of the acquisition loop is written into its own slot
+		self.allocateRunBuffer()
+		self.startAcquisition(self.runBuffer)
+
+	# Size of a single image in (binned) pixels, as (rows, columns) read off the camera
+	def getImageShape(self):
+		dy = self.gConfig['dy']
+		dx = self.gConfig['dx']
+
+		if (self.gConfig['binning']):
+			dy //= KRBCAM_BIN_SIZE
+			dx //= KRBCAM_BIN_SIZE
+		return (dy, dx)
+
+	# Pixel type of the data: 16-bit counts if requested, otherwise 32-bit
+	def getPixelType(self):
+		if self.gConfig['readout16']:
+			return np.uint16
+		else:
+			return np.int32
+
+	# Allocate the buffer for all of the frames in one acquisition loop
+	# Shape is (acqLength, kinFrames, rows, columns), in the orientation the images
+	# come off of the camera: rotated if the SDK rotates them, otherwise rotating
+	# the image is left to the display and save steps (see needsRotation).
+	# A fresh buffer is allocated for every loop, so the previous one
+	# can still be displayed (and saved) while this one fills up.
+	def allocateRunBuffer(self):
+		(dy, dx) = self.getImageShape()
+		if self.gFlagSDKRotate:
+			(dy, dx) = (dx, dy)
+		dtype = self.getPixelType()
+		self.runBuffer = np.zeros((self.gAcqLoopLength, self.gFKSeriesLength, dy, dx), dtype=dtype)
+
+	# Does the data in the run buffer still need to be rotated?
+	def needsRotation(self):
+		return self.gConfig['rotateImage'] and not self.gFlagSDKRotate
 
 	# Start acquisition
 	# Tells the camera to start acquiring data
 	# Also sets up a deferred call to the checkForData method
 	def startAcquisition(self, data):
 		# Start acquiring
+		start = self.metrics.start()
 		ret = self.AndorCamera.StartAcquisition()
+		self.metrics.stop('start', start)
 		msg = self.AndorCamera.handleErrors(ret, "StartAcquisition error: ", "Acquiring...")
 
 		if ret != self.AndorCamera.DRV_SUCCESS:
 			self.throwErrorMessage("Acquisition error!", msg)
 		else:
-			# Set a timer for looking for the data
+			# Set a timer (or a wait) for looking for the data
 			self.appendToStatus("Acquiring...\n")
-			self.acquireCallback = self.reactor.callLater(KRBCAM_ACQ_TIMER, self.checkForData, data)
+			self.acquireStart = self.metrics.start()
+			self.scheduleCheckForData(data)
+
+	# Arrange for checkForData (checkForStreamData when streaming) to run once the camera may be done
+	#
+	# Polling: check GetStatus again after KRBCAM_ACQ_TIMER seconds
+	# Waiting: block on WaitForAcquisitionTimeOut in the acquisition thread,
+	# and call checkForData from the reactor as soon as the wait returns.
+	# The wait is capped at KRBCAM_ACQ_WAIT_TIMEOUT ms so that checkForData
+	# still gets a chance to notice timeouts if no acquisition event arrives.
+	def scheduleCheckForData(self, data):
+		if self.gFlagStream:
+			check = self.checkForStreamData
+		else:
+			check = self.checkForData
+
+		if self.gFlagWait:
+			self.acquireCallback = threads.deferToThreadPool(self.reactor, self.acqThreadPool,
+				self.AndorCamera.WaitForAcquisitionTimeOut, KRBCAM_ACQ_WAIT_TIMEOUT)
+			self.acquireCallback.addCallback(self.waitForDataDone, check, data)
+			self.acquireCallback.addErrback(self.waitForDataFailed)
+		else:
+			self.acquireCallback = self.reactor.callLater(KRBCAM_ACQ_TIMER, check, data)
+
+	# Fires in the reactor thread when WaitForAcquisitionTimeOut returns
+	# ret is DRV_SUCCESS for an acquisition event, DRV_NO_NEW_DATA if the wait
+	# timed out or was cancelled; check (checkForData) sorts out which case we are in
+	def waitForDataDone(self, ret, check, data):
+		check(data)
+
+	# Errback for the acquisition wait
+	# A cancelled Deferred (abort, closing the GUI) is expected, anything else is reported
+	def waitForDataFailed(self, failure):
+		if failure.check(CancelledError):
+			return
+		self.throwErrorMessage("Error waiting for acquisition.", str(failure.value))
+
+	# Wake up the acquisition thread if it is blocked in WaitForAcquisitionTimeOut
+	def cancelWait(self):
+		if self.gFlagWait:
+			try:
+				self.AndorCamera.CancelWait()
+			except:
+				pass
 
 	# Method that fires after the KRBCAM_ACQ_TIMEOUT time has elapsed after the first frame is acquired
 	# data argument holds list of numpy arrays that contain the data collected so far in this acquisition
@@ -489,11 +739,22 @@ class MainWindow(QtGui.QWidget):
 		msg = "Timed out after acquiring {} of {} in series.\n".format(self.gAcqLoopCounter, self.gAcqLoopLength)
 		self.appendToStatus(msg)
 		print(msg)
+		# Release a pending wait so that checkForData handles the timeout right away
+		self.cancelWait()
 		try:
 			self.alerter.say("Oh no! The camera timed out!")
 		except Exception as e:
 			pass
 
+	# Start the timeout for the acquisition, unless it is already running
+	# This is done once the first shot of the acquisition loop has been acquired
+	def startTimeout(self):
+		try:
+			if not self.timeoutCallback.active():
+				self.timeoutCallback = self.reactor.callLater(KRBCAM_ACQ_TIMEOUT, self.timeoutAcquisition)
+		except AttributeError:
+			self.timeoutCallback = self.reactor.callLater(KRBCAM_ACQ_TIMEOUT, self.timeoutAcquisition)
+
 	# Cancel the timeout for the acquisition
 	def cancelTimeout(self):
 		self.timedOut = False
@@ -503,7 +764,7 @@ class MainWindow(QtGui.QWidget):
 			pass
 
 	# Method that fires after the KRBCAM_ACQ_TIMER time has elapsed
-	# data argument holds list of numpy arrays that contain the data collected so far in this acquisition
+	# data argument is the run buffer that holds the data collected so far in this acquisition
 	def checkForData(self, data):
 		# Check if the camera is still acquiring:
 		(ret, status) = self.AndorCamera.GetStatus()
@@ -518,7 +779,7 @@ class MainWindow(QtGui.QWidget):
 			# If still acquiring, run the timer again
 			if not timedOut and status == self.AndorCamera.DRV_ACQUIRING:
 				# Check back for new data later
-				self.acquireCallback = self.reactor.callLater(KRBCAM_ACQ_TIMER, self.checkForData, data)
+				self.scheduleCheckForData(data)
 
 			# If idle, then data has been acquired
 			elif timedOut or status == self.AndorCamera.DRV_IDLE:
@@ -530,173 +791,247 @@ class MainWindow(QtGui.QWidget):
 				if not timedOut:
 					self.appendToStatus("Acquired {} of {} in series.\n".format(self.gAcqLoopCounter, self.gAcqLoopLength))
 				
-				# Get the data off of the camera
+				# Get the data off of the camera and put it in this shot's slot of the run buffer
 				if not timedOut:
-					newData = self.getData()
-				else:
-					newData = self.getEmptyData()
-
-				# If we need to rotate image
-				if self.gConfig['rotateImage']:
-					# The axes are kinetics frame, height, width
-					newData = np.flip(np.swapaxes(np.array(newData), 1, 2), axis=-1)
+					self.metrics.stop('wait', self.acquireStart)
+					readout = self.metrics.start()
+					if self.getData(data[self.gAcqLoopCounter - 1]):
+						self.abandonShot('readout')
+						return
+					self.metrics.stop('readout', readout)
+				# If timed out, this frame and all remaining frames are left blank
 				else:
-					newData = np.array(newData)
-
-				print(np.shape(np.array(newData)))
-
-				# Append it to the data array
-				if self.gAcqLoopCounter > 1:
-					for i in range(len(data)):
-						data[i] = np.concatenate((data[i], newData[i]))
-					# Add all remaining frames if timed out
-					if timedOut:
-						n_frames = 0
-						while self.gAcqLoopCounter < self.gAcqLoopLength:
-							for i in range(len(data)):
-								data[i] = np.concatenate((data[i], newData[i]))
-							self.gAcqLoopCounter += 1
-							n_frames += 1
-						self.appendToStatus("{} blank frames added.\n".format(n_frames + 1))
-				else:
-					for i in range(len(newData)):
-						data.append(newData[i])
+					self.gAcqLoopCounter -= 1
+					self.addBlankFrames(data)
 
 				# If need to take more in the OD series, acquire again
 				if self.gAcqLoopCounter < self.gAcqLoopLength and not timedOut:
 					# If the first shot has been acquired, start the timeout for the acquisition
 					if self.gAcqLoopCounter == 1:
-						try:
-							if not self.timeoutCallback.active():
-								self.timeoutCallback = self.reactor.callLater(KRBCAM_ACQ_TIMEOUT, self.timeoutAcquisition)
-						except AttributeError:
-							self.timeoutCallback = self.reactor.callLater(KRBCAM_ACQ_TIMEOUT, self.timeoutAcquisition)
+						self.startTimeout()
 					self.startAcquisition(data)
 				# Otherwise we are done acquiring!
 				else:
-					# Double check the directory
-					# This catches when the directory should roll over at midnight
-					self.configForm.checkDir()
-					self.gConfig = self.configForm.getFormData()
-
-					# If we're saving the files
-					if self.gConfig['saveFiles']:
-	 					# Save data
-						self.appendToStatus("Saving data...\n")
-	 					if self.gAcqMode == KRBCAM_ACQ_MODE_FK:
-
-	 						# This is an ugly way of doing this but oh well
-	 						savearray = data[0]
-	 						# Save all the data as one file
-	 						# So the data file will have e.g.
-	 						# K shadow, light, dark, Rb shadow, light, dark
-							for j in range(1, self.gFKSeriesLength):
-								savearray = np.concatenate((savearray, data[j]))
-							self.saveData(savearray)
-							self.appendToStatus("Data saved.\n")
-						elif self.gAcqMode == KRBCAM_ACQ_MODE_SINGLE:
-							self.saveData(data[0])
-							self.appendToStatus("Data saved.\n")
-					else:
-						self.appendToStatus("Data saving is turned off.\n")
-
-						# Update file number
-						self.gConfig['fileNumber'] += 1
-						self.configForm.setFormData(self.gConfig)
-
-					# Display the data
-					self.imageWindow.imageRotated(self.gConfig['rotateImage'])
-					self.imageWindow.setData(data, self.gFKSeriesLength, self.gAcqLoopLength)
-					self.imageWindow.displayData()
-
-					# Check timeout status and cancel callback
-					self.cancelTimeout()
-	
-					# if not looping:
-					if not self.gFlagLoop:
-						# Disable abort button, enable acquire button
-						self.acquireAbortStatus.abort()
-					# if looping:
-					else:
-						# if timed out, abort and restart acquisition
-						if timedOut:
-							self.abortAcquisition(False)
-						self.setupAcquisition(False)
+					self.finishAcquisition(data, timedOut)
 
 			# Otherwise some error has occurred in the acquisition
 			else:
 				self.throwErrorMessage("Error in acquisition loop.", "Camera state is {}".format(status))
 
-	# Get data from camera
-	def getData(self):
-		# First need to get the total size of the image in binned pixels
-		dy = self.gConfig['dy']
-		dx = self.gConfig['dx']
+	# Streaming counterpart of checkForData
+	# The camera stays armed in Run till Abort, so instead of waiting for it to go idle,
+	# pull every image that has arrived off of the circular buffer into the run buffer
+	def checkForStreamData(self, data):
+		# Check that the camera is still acquiring:
+		(ret, status) = self.AndorCamera.GetStatus()
+		msg = self.AndorCamera.handleErrors(ret, "GetStatus error: ", "")
 
-		if (self.gConfig['binning']):
-			dy /= KRBCAM_BIN_SIZE
-			dx /= KRBCAM_BIN_SIZE
-		dataLength = self.gFKSeriesLength * dy * dx
+		timedOut = self.timedOut
+
+		# if error, throw message, quit SDK
+		if ret != self.AndorCamera.DRV_SUCCESS:
+			self.throwErrorMessage("Error communicating with camera.", msg)
+			return
+		# The camera keeps acquiring for as long as we are streaming
+		elif not timedOut and status != self.AndorCamera.DRV_ACQUIRING:
+			self.throwErrorMessage("Error in acquisition loop.", "Camera state is {}".format(status))
+			return
+
+		# Read every image waiting on the camera into the next slot of the run buffer
+		while not timedOut and self.gAcqLoopCounter < self.gAcqLoopLength:
+			index = self.gAcqLoopCounter
+
+			readout = self.metrics.start()
+			newImage = self.getStreamData(data[index])
+			if newImage == -1:
+				self.abandonShot('readout')
+				return
+			elif newImage == 0:
+				break
+			# Waiting is counted up to the check that found the image
+			self.metrics.stop('wait', self.acquireStart, readout)
+			self.metrics.stop('readout', readout)
+			self.acquireStart = self.metrics.start()
+
+			# Increment OD series counter since we've taken an image
+			self.gAcqLoopCounter += 1
+			self.appendToStatus("Acquired {} of {} in series.\n".format(self.gAcqLoopCounter, self.gAcqLoopLength))
+
+			# If the first shot has been acquired, start the timeout for the acquisition
+			if self.gAcqLoopCounter == 1:
+				self.startTimeout()
+
+		# If timed out, the remaining frames are left blank
+		if timedOut:
+			self.addBlankFrames(data)
+
+		if self.gAcqLoopCounter < self.gAcqLoopLength:
+			# Check back for new data later
+			self.scheduleCheckForData(data)
+		else:
+			self.finishAcquisition(data, timedOut)
+
+	# Leave the rest of the run buffer blank after a timeout
+	# and mark the acquisition loop as complete
+	def addBlankFrames(self, data):
+		n_frames = self.gAcqLoopLength - self.gAcqLoopCounter
+		data[self.gAcqLoopCounter:] = 0
+		self.gAcqLoopCounter = self.gAcqLoopLength
+		self.appendToStatus("{} blank frames added.\n".format(n_frames))
+
+	# All shots in the acquisition loop are in: save, display, and start the next loop
+	def finishAcquisition(self, data, timedOut):
+		# Double check the directory
+		# This catches when the directory should roll over at midnight
+		self.configForm.checkDir()
+		self.gConfig = self.configForm.getFormData()
+		fileNumber = self.gConfig['fileNumber']
+
+		# If we're saving the files
+		if self.gConfig['saveFiles']:
+			# Save data
+			self.appendToStatus("Saving data...\n")
+			save = self.metrics.start()
+			self.saveData(data)
+			self.metrics.stop('save', save)
+		else:
+			fileNumber = None
+			self.appendToStatus("Data saving is turned off.\n")
+
+			# Update file number
+			self.gConfig['fileNumber'] += 1
+			self.configForm.setFormData(self.gConfig)
+
+		# Display the data
+		# Rotating it and calculating the ODs happens in the processing thread
+		self.imageWindow.imageRotated(self.gConfig['rotateImage'])
+		shot = self.metrics.hold()
+		start = self.metrics.start()
+		d = self.processor.process(data, self.needsRotation(), self.imageWindow.getODSelections())
+		d.addCallback(self.shotProcessed, self.gFKSeriesLength, self.gAcqLoopLength, shot, start)
+		d.addErrback(self.shotProcessingFailed, shot)
+
+		# Check timeout status and cancel callback
+		self.cancelTimeout()
+
+		# The shot is logged once it has been written and drawn
+		if self.metrics.endShot(self.gConfig['savePath'], [('file', fileNumber), ('timedOut', timedOut)]):
+			self.updateMetricsStatus()
+
+		# if not looping:
+		if not self.gFlagLoop:
+			# Disable abort button, enable acquire button
+			self.acquireAbortStatus.abort()
+			self.stopLiveView()
+		# if looping:
+		else:
+			# Hold off until the writer has space for the next run
+			if self.writer.isFull():
+				self.appendToStatus("Save queue full, waiting for the writer...\n")
+				self.acquireCallback = self.writer.whenReady()
+				self.acquireCallback.addCallback(lambda _: self.continueAcquisition(timedOut))
+				self.acquireCallback.addErrback(self.waitForDataFailed)
+			else:
+				self.continueAcquisition(timedOut)
+
+	# Start the next run of the acquisition loop
+	def continueAcquisition(self, timedOut):
+		# if timed out, abort and restart acquisition
+		if timedOut:
+			self.abortAcquisition(False)
+			self.setupAcquisition(False)
+		# if streaming, the camera is still armed,
+		# so just start filling a new run buffer
+		elif self.gFlagStream:
+			self.metrics.beginShot()
+			self.acquireStart = self.metrics.start()
+			self.gAcqLoopCounter = 0
+			self.allocateRunBuffer()
+			self.scheduleCheckForData(self.runBuffer)
+		else:
+			self.setupAcquisition(False)
+
+	# Display a shot that is back from the processing thread
+	# result is None if the shot was skipped for a newer one
+	# shot and start are the shot's metrics and when processing was asked for (None if not timing)
+	def shotProcessed(self, result, kinFrames, acqLength, shot=None, start=None):
+		if result is None:
+			self.releaseShot(shot)
+			return
+		self.metrics.span(shot, 'process', start)
+		(frames, ods, limits) = result
+		self.imageWindow.setData(frames, kinFrames, acqLength, ods, limits)
+		self.imageWindow.displayData()
+		if shot is not None:
+			self.imageWindow.whenDrawn(lambda start, end: self.releaseShot(shot, 'draw', start, end))
+
+	def shotProcessingFailed(self, failure, shot=None):
+		self.releaseShot(shot)
+		self.appendToStatus("Error processing shot for display: {}\n".format(failure.value))
+
+	# The acquisition loop stopped with an error (e.g. 'readout'),
+	# log the shot being timed anyway, with the error
+	def abandonShot(self, error):
+		if self.metrics.endShot(self.gConfig['savePath'], [('file', None), ('timedOut', self.timedOut), ('error', error)]):
+			self.updateMetricsStatus()
+		self.metrics.flush()
+
+	# Release a hold on the metrics of shot (see ShotMetrics), adding a span for stage if given
+	def releaseShot(self, shot, stage=None, start=None, end=None):
+		if self.metrics.release(shot, stage, start, end):
+			self.updateMetricsStatus()
+
+	def updateMetricsStatus(self):
+		self.acquireAbortStatus.setMetricsSummary(self.metrics.summary())
 
+	# Get data from camera
+	# out is the array the images are read into, shape (kinFrames, rows, columns)
+	# Returns 0 on success, -1 on a readout error
+	def getData(self, out):
 		# Now ask the camera for data
 		# getData first queries the camera for available images
-		# then takes the images
-		(errf, errm, data) = self.AndorCamera.getData(dataLength)
+		# then reads them straight into out
+		(errf, errm, data) = self.AndorCamera.getData(out)
 		if errf:
 			self.throwErrorMessage("Data readout error:", errm)
 			self.abortAcquisition()
 			return -1
 		else:
-			# Data is returned as a ctypes array of c_longs
-			# Need to convert to numpy array
-			data = np.ctypeslib.as_array(data)
-
-			out = []
-
-			# Data is returned as one long array
-			# Need to split it up to get the individual images
-			num_images = self.gFKSeriesLength
-			image_length = len(data)/num_images
-			
-			# For each Fast Kinetics frame:
-			for i in range(num_images):
-				# Get the image and resize to the correct dimensions
-				image = np.resize(data[i*image_length : (i+1)*image_length], (dy, dx))
-				out.append(image)
-
-			return out
-
-	# Get zeros, as if from camera
-	def getEmptyData(self):
-		# First need to get the total size of the image in binned pixels
-		dy = self.gConfig['dy']
-		dx = self.gConfig['dx']
-
-		if (self.gConfig['binning']):
-			dy /= KRBCAM_BIN_SIZE
-			dx /= KRBCAM_BIN_SIZE
-		dataLength = self.gFKSeriesLength * dy * dx
-
-		# Make a numpy array of zeros
-		data = np.zeros(dataLength, dtype=np.int32)
-
-		out = []
-
-		# Data is returned as one long array
-		# Need to split it up to get the individual images
-		num_images = self.gFKSeriesLength
-		image_length = len(data)/num_images
-		
-		# For each Fast Kinetics frame:
-		for i in range(num_images):
-			# Get the image and resize to the correct dimensions
-			image = np.resize(data[i*image_length : (i+1)*image_length], (dy, dx))
-			out.append(image)
+			# 16-bit counts clip instead of overflowing (e.g. when binning bright pixels)
+			# so flag any pixel sitting at the top of the range
+			if data.dtype == np.uint16 and data.max() >= KRBCAM_MAX_COUNTS_16:
+				n = np.count_nonzero(data >= KRBCAM_MAX_COUNTS_16)
+				self.appendToStatus("Warning: {} pixels saturated at {} counts in 16-bit readout.\n".format(n, KRBCAM_MAX_COUNTS_16))
+			return 0
 
-		return out
+	# Get the next streamed image from camera
+	# out is the array the image is read into, shape (1, rows, columns)
+	# Returns 1 if an image was read, 0 if no image is waiting, -1 on a readout error
+	def getStreamData(self, out):
+		(errf, errm, newImage) = self.AndorCamera.getOldestImage(out)
+		if errf:
+			self.throwErrorMessage("Data readout error:", errm)
+			self.abortAcquisition()
+			return -1
+		elif not newImage:
+			return 0
+		else:
+			return 1
 
 	# Save data array
-	def saveData(self, data_array, npz=False):
+	# data is the run buffer, indexed by (acquisition loop frame, FK frame, row, column)
+	# The file is written in the background by self.writer; the run buffer
+	# is not reused after the run, so it is safe to hand over as is.
+	def saveData(self, data):
+		# Save all the data as one file, ordered by FK frame first
+		# So the data file will have e.g.
+		# K shadow, light, dark, Rb shadow, light, dark
+		#
+		# These are views; the data is only copied in the writer thread
+		if self.needsRotation():
+			data = rotateFrames(data)
+		frames = np.swapaxes(data, 0, 1)
+
 		# The save path
 		path = self.gConfig['savePath'] + self.gConfig['filebase'] + '_' + str(self.gConfig['fileNumber'])
 
@@ -704,9 +1039,10 @@ class MainWindow(QtGui.QWidget):
 		# Otherwise, fitting program autoloads the file before writing is complete
 		path_temp = path + "_temp"
 		form = self.configForm.getFormData()
-		if self.gConfig['saveNpz']:
-			path += ".npz"
-			path_temp += ".npz"
+		saveFormat = self.gConfig['saveFormat']
+		if saveFormat in ('npz', 'npy'):
+			path += "." + saveFormat
+			path_temp += "." + saveFormat
 
 			metadata = {
 				'camera': 'Andor iXon 888',
@@ -719,23 +1055,50 @@ class MainWindow(QtGui.QWidget):
 				'em_gain': self.gConfig['emGain'],
 				'preamp_gain': self.gConfig['preAmpGain'],
 				'vs_speed': self.gConfig['vss']
-        	}
-
-			with open(path_temp, 'wb') as f:
-				reshaped = data_array.reshape((-1, self.gConfig['dx']//metadata['binning'][0], self.gConfig['dy']//metadata['binning'][0]))
-				print(reshaped.shape)
-				np.savez_compressed(f, data=reshaped, meta=metadata)
+			}
+			# One image after another, each in the orientation it is displayed in
+			shape = (-1,) + frames.shape[-2:]
 
-			# Once file is written, rename to the correct filename
-			os.rename(path_temp, path)
+			if saveFormat == 'npz':
+				d = self.writer.submit(writeNpz, path_temp, path, frames, shape, metadata)
+			else:
+				d = self.writer.submit(writeNpy, path_temp, path, frames, shape, metadata)
 		else:
 			path += ".csv"
 			path_temp += ".csv"
 
-			np.savetxt(path_temp, data_array, fmt='%d', delimiter=',')
+			d = self.writer.submit(writeCsv, path_temp, path, frames)
+
+		# The file won't show up in the directory until it's written,
+		# so hold on to its number
+		self.configForm.reserveFileNumber(self.gConfig['savePath'], self.gConfig['filebase'], self.gConfig['fileNumber'])
+		self.gConfig['fileNumber'] += 1
+		self.configForm.setFormData(self.gConfig)
+
+		shot = self.metrics.hold()
+		d.addCallbacks(self.saveDataDone, self.saveDataFailed, callbackArgs=(path, self.gConfig['savePath'], shot), errbackArgs=(path, self.gConfig['savePath'], shot))
+		self.updateWriterStatus()
+
+	# result is (write time, time spent publishing) in seconds, see ShotWriter
+	def saveDataDone(self, result, path, savedir, shot=None):
+		(latency, published) = result
+		self.configForm.filePublished(savedir)
+		self.appendToStatus("Data saved to {} ({:.0f} ms).\n".format(os.path.basename(path), 1000*latency))
+		self.updateWriterStatus()
 
-			# Once file is written, rename to the correct filename
-			os.rename(path_temp, path)
+		# Writing (and compressing) the file, then renaming it into place
+		now = time.time()
+		self.metrics.span(shot, 'write', now - latency, now - published)
+		self.releaseShot(shot, 'publish', now - published, now)
+
+	def saveDataFailed(self, failure, path, savedir, shot=None):
+		self.configForm.fileFailed(savedir)
+		self.releaseShot(shot)
+		self.updateWriterStatus()
+		self.throwErrorMessage("Error saving data to " + path, str(failure.value))
+
+	def updateWriterStatus(self):
+		self.acquireAbortStatus.setWriterStatus(self.writer.pending, self.writer.lastLatency)
 
 	# Abort an acquisition
 	def abortAcquisition(self, showErrors=True):
@@ -747,7 +1110,7 @@ class MainWindow(QtGui.QWidget):
 			self.throwErrorMessage("AbortAcquisition error!", "Error code: {}".format(ret))
 
 		# Next, close the internal shutter for safety
-		ret2 = self.AndorCamera.SetShutter(1, 2, 0, 0)
+		ret2 = self.AndorCamera.closeShutter()
 		if ret2 == self.AndorCamera.DRV_SUCCESS:
 			self.appendToStatus("Internal shutter closed.\n")
 		elif showErrors:
@@ -757,6 +1120,8 @@ class MainWindow(QtGui.QWidget):
 		self.cancelTimeout()
 
 		# Next, kill the getData callback
+		# (release the acquisition thread first if it is waiting)
+		self.cancelWait()
 		try:
 			self.acquireCallback.cancel()
 		# This happens if abort button is hit before ever acquiring
@@ -770,6 +1135,18 @@ class MainWindow(QtGui.QWidget):
 
 		# Enable acquire, disable abort buttons
 		self.acquireAbortStatus.abort()
+		self.stopLiveView(showErrors)
+
+	# Stop limiting the redraw rate, and report how many redraws were coalesced
+	# and how many shots the processing thread skipped
+	# Also write out the shot metrics that are waiting
+	def stopLiveView(self, report=True):
+		self.imageWindow.setLive(False)
+		self.metrics.flush()
+		if report:
+			(requests, redraws) = self.imageWindow.getRedrawStats()
+			dropped = self.processor.getDropped()
+			self.appendToStatus("Display: {} redraws requested, {} drawn ({} suppressed), {} shots skipped for newer ones.\n".format(requests, redraws, requests - redraws, dropped))
 
 	# Populate the gui
 	def populate(self):
@@ -861,10 +1238,21 @@ class MainWindow(QtGui.QWidget):
 	# The window will close when the function returns if we run the method event.accept()
 	# If we run event.ignore(), the window does not close and program keeps running
 	def closeEvent(self, event):
+		# Don't lose shots that are still being written
+		if self.writer.pending:
+			msgBox = QtGui.QMessageBox()
+			msgBox.setText("Data is still being saved.")
+			msgBox.setInformativeText("{} files are waiting to be written. Try again in a moment.".format(self.writer.pending))
+			msgBox.setStandardButtons(QtGui.QMessageBox.Ok)
+			msgBox.exec_()
+			event.ignore()
+			return
+
 		flag = False
 		# Try to stop the acquisition timeout
 		self.cancelTimeout()
 		# Try to stop the acquisition loop
+		self.cancelWait()
 		try:
 			self.acquireCallback.cancel()
 		except:
@@ -940,6 +1328,7 @@ class MainWindow(QtGui.QWidget):
 		self.cancelTimeout()
 
 		# Try to end the acquisition loop
+		self.cancelWait()
 		try:
 			self.acquireCallback.cancel()
 		except: pass
@@ -957,9 +1346,21 @@ class MainWindow(QtGui.QWidget):
 
 
 if __name__ == '__main__':
-    a = QtGui.QApplication([])
+    parser = argparse.ArgumentParser(description="KRbCam: iXon Fast Kinetics Imaging")
+    parser.add_argument('--rescan-cameras', action='store_true',
+                        help="read every camera's serial number instead of using the camera cache")
+    parser.add_argument('--refresh-caps', action='store_true',
+                        help="read the camera capabilities from the camera instead of the capability cache")
+    parser.add_argument('--simulate', action='store_true',
+                        help="use the simulated camera instead of the Andor SDK (same as KRBCAM_SIMULATE=1)")
+    parser.add_argument('--metrics', action='store_true',
+                        help="time the stages of every shot, logged to {} in the save folder (same as KRBCAM_METRICS = True)".format(KRBCAM_METRICS_LOG_FILE))
+    # Leave anything else for Qt
+    (args, qtArgs) = parser.parse_known_args()
+
+    a = QtGui.QApplication(sys.argv[:1] + qtArgs)
     a.setQuitOnLastWindowClosed(True)
-    widget = MainWindow(reactor)
+    widget = MainWindow(reactor, rescanCameras=args.rescan_cameras, refreshCaps=args.refresh_caps, metrics=args.metrics or KRBCAM_METRICS)
 
     appico = QtGui.QIcon()
     appico.addFile('main.ico')
@@ -0,0 +1,313 @@
+# Shot latency benchmark
+#
+# Runs the GUI against the simulated camera (lib/sim_atmcd.py) and times each stage
+# of the acquisition loop: arming, StartAcquisition, noticing that the camera is done,
+# readout, saving, processing and drawing, plus trigger -> file published and
+# trigger -> image drawn. Reports latency percentiles for each stage and the
+# sustained number of shots (acquisition loops, i.e. saved files) per second,
+# for every combination of frame size, kinFrames and acqLength asked for.
+#
+# Run from the main directory, e.g.
+#	python benchmark.py --sizes 1024x512,512x512 --kin-frames 2 --acq-length 3 --shots 20
+# Results are written as JSON (--output), to compare between versions.
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import functools
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+
+def parseArgs():
+	parser = argparse.ArgumentParser(description="KRbCam shot latency benchmark (simulated camera)")
+	parser.add_argument('--sizes', default='1024x512',
+						help="comma separated frame sizes, as columns x rows (unbinned pixels)")
+	parser.add_argument('--kin-frames', default='2', help="comma separated numbers of FK frames")
+	parser.add_argument('--acq-length', default='3', help="comma separated acquisition loop lengths")
+	parser.add_argument('--shots', type=int, default=10, help="acquisition loops to time for each case")
+	parser.add_argument('--warmup', type=int, default=1, help="acquisition loops to run before timing")
+	parser.add_argument('--trigger-period', type=float, default=0.1, help="s between simulated external triggers")
+	parser.add_argument('--exposure', type=float, default=1.0, help="exposure time in ms")
+	parser.add_argument('--format', default='npz', help="save format: npz, npy or csv")
+	parser.add_argument('--binning', action='store_true', help="bin the images")
+	parser.add_argument('--rotate', action='store_true', help="rotate the images")
+	parser.add_argument('--readout16', action='store_true', help="16-bit readout")
+	parser.add_argument('--fast-view', action='store_true', help="draw with the fast live view instead of matplotlib")
+	parser.add_argument('--timeout', type=float, default=120, help="s before giving up on a case")
+	parser.add_argument('--output', default='benchmark_results.json', help="file to write the results to")
+	parser.add_argument('--keep-files', action='store_true', help="don't delete the saved shots")
+	return parser.parse_args()
+
+# The camera backend and the trigger period are picked up when the GUI is imported
+args = parseArgs()
+os.environ['KRBCAM_SIMULATE'] = '1'
+os.environ['KRBCAM_SIM_TRIGGER_PERIOD'] = str(args.trigger_period)
+
+from PyQt4 import QtGui
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.task import deferLater
+
+import andor_gui
+from andor_gui import MainWindow, reactor
+
+# The durations of each stage in one case, in seconds
+class StageTimes(object):
+	def __init__(self):
+		self.times = OrderedDict()
+		# Trigger time of the acquisition loop being finished, and of the shot waiting to be drawn
+		self.loopTrigger = None
+		self.displayTrigger = None
+		# Acquisition loops finished, and when the first and last ones finished
+		self.shots = 0
+		self.start = None
+		self.end = None
+
+	def add(self, stage, seconds):
+		self.times.setdefault(stage, []).append(seconds)
+
+	# Percentiles of each stage, in ms
+	def summary(self):
+		stages = OrderedDict()
+		for (stage, t) in self.times.items():
+			t = 1000*np.array(t)
+			stages[stage] = OrderedDict([
+				('n', len(t)),
+				('mean_ms', float(t.mean())),
+				('p50_ms', float(np.percentile(t, 50))),
+				('p90_ms', float(np.percentile(t, 90))),
+				('p95_ms', float(np.percentile(t, 95))),
+				('p99_ms', float(np.percentile(t, 99))),
+				('max_ms', float(t.max())),
+			])
+		return stages
+
+# Times the stages of the acquisition loop, into a fresh StageTimes for each case
+# Callbacks that fire later record into the StageTimes of the shot they belong to
+class Benchmark(object):
+	def __init__(self):
+		self.times = StageTimes()
+		# Acquisition loops finished in this case, and how many to run
+		self.loops = 0
+		self.target = 0
+
+	# Replace obj.name with a version that records how long each call takes
+	def wrap(self, obj, name, stage):
+		method = getattr(obj, name)
+		@functools.wraps(method)
+		def timed(*a, **kw):
+			times = self.times
+			start = time.time()
+			try:
+				return method(*a, **kw)
+			finally:
+				times.add(stage, time.time() - start)
+		setattr(obj, name, timed)
+
+def instrument(window, bench):
+	camera = window.AndorCamera
+	image = window.imageWindow
+
+	# Arming
+	for name in ['armiXon', 'setupAcquisition', 'setupFastKinetics', 'setupImage', 'setupRotation']:
+		bench.wrap(camera, name, 'arm.' + name)
+	bench.wrap(camera, 'StartAcquisition', 'start')
+
+	# Readout, and how long it took to notice that the camera was done
+	getData = window.getData
+	def timedGetData(out):
+		times = bench.times
+		times.add('detect', time.time() - camera.lastDone)
+		times.add('camera', camera.lastDone - camera.lastTrigger)
+		start = time.time()
+		try:
+			return getData(out)
+		finally:
+			times.add('readout', time.time() - start)
+	window.getData = timedGetData
+
+	# The end of the acquisition loop: hands the shot to the writer and the processing thread
+	# The last loop of the case doesn't start another one
+	finishAcquisition = window.finishAcquisition
+	def timedFinishAcquisition(data, timedOut):
+		times = bench.times
+		times.loopTrigger = camera.lastTrigger
+		times.shots += 1
+		if times.start is None:
+			times.start = time.time()
+		times.end = time.time()
+
+		bench.loops += 1
+		if bench.loops >= bench.target:
+			window.gFlagLoop = False
+
+		start = time.time()
+		finishAcquisition(data, timedOut)
+		times.add('finish', time.time() - start)
+
+		# Throw away the warm up loops
+		if bench.loops == args.warmup:
+			bench.times = StageTimes()
+	window.finishAcquisition = timedFinishAcquisition
+	bench.wrap(window, 'saveData', 'save')
+
+	# Writing the file, and trigger -> file published
+	submit = window.writer.submit
+	def timedSubmit(write, *a):
+		times = bench.times
+		(trigger, start) = (times.loopTrigger, time.time())
+		def written(result):
+			latency = result[0]
+			times.add('write', latency)
+			times.add('write_queue', time.time() - start - latency)
+			times.add('trigger_to_published', time.time() - trigger)
+			return result
+		return submit(write, *a).addCallback(written)
+	window.writer.submit = timedSubmit
+
+	# Processing for display, and trigger -> image drawn
+	process = window.processor.process
+	def timedProcess(data, rotate, selections):
+		times = bench.times
+		(trigger, start) = (times.loopTrigger, time.time())
+		def processed(result):
+			if result is None:
+				times.add('process_dropped', 0)
+			else:
+				times.add('process', time.time() - start)
+				times.displayTrigger = trigger
+			return result
+		return process(data, rotate, selections).addCallback(processed)
+	window.processor.process = timedProcess
+
+	drawData = image.drawData
+	def timedDrawData():
+		times = bench.times
+		start = time.time()
+		drawData()
+		now = time.time()
+		times.add('draw', now - start)
+		if times.displayTrigger is not None:
+			times.add('trigger_to_drawn', now - times.displayTrigger)
+			times.displayTrigger = None
+	image.drawData = timedDrawData
+
+# Set up the config form for a case
+def configure(window, case, savedir):
+	form = window.configForm
+	config = form.getFormData()
+	config.update({
+		'kinFrames': case['kinFrames'],
+		'acqLength': case['acqLength'],
+		'dx': case['dx'],
+		'dy': case['dy'],
+		'xOffset': 0,
+		'yOffset': 0,
+		'expTime': args.exposure,
+		'binning': args.binning,
+		'emEnable': False,
+		'emGain': 0,
+		'savePath': savedir,
+		'fileNumber': 0,
+	})
+	form.setFormData(config)
+	form.saveEnableControl.setChecked(True)
+	form.saveFormatControl.setCurrentIndex(andor_gui.KRBCAM_SAVE_FORMATS.index(args.format))
+	form.rotateImageControl.setChecked(args.rotate)
+	form.readout16Control.setChecked(args.readout16)
+	form.streamControl.setChecked(False)
+	window.imageWindow.rasterControl.setChecked(args.fast_view)
+
+def sleep(seconds):
+	return deferLater(reactor, seconds, lambda: None)
+
+# Run one case: warm up, then time args.shots acquisition loops
+@inlineCallbacks
+def runCase(window, bench, case):
+	savedir = tempfile.mkdtemp(prefix='krbcam_bench_') + os.sep
+	configure(window, case, savedir)
+
+	bench.times = StageTimes()
+	bench.loops = 0
+	bench.target = args.warmup + args.shots
+	window.gFlagLoop = True
+	window.setupAcquisition(True)
+
+	deadline = time.time() + args.timeout
+	while bench.loops < bench.target and time.time() < deadline:
+		yield sleep(0.01)
+	if bench.loops < bench.target:
+		print("  Timed out after {} acquisition loops".format(bench.loops))
+		window.gFlagLoop = False
+		window.abortAcquisition(False)
+	times = bench.times
+
+	# Let the writer and the display catch up
+	while window.writer.pending or window.processor.busy or window.imageWindow.redrawPending:
+		yield sleep(0.01)
+
+	result = OrderedDict()
+	result['case'] = case
+	result['shape'] = list(window.getImageShape())
+	result['shots'] = times.shots
+	if times.shots > 1:
+		result['shotsPerSecond'] = (times.shots - 1)/(times.end - times.start)
+	result['stages'] = times.summary()
+
+	if not args.keep_files:
+		shutil.rmtree(savedir, ignore_errors=True)
+	returnValue(result)
+
+def gitVersion():
+	try:
+		return subprocess.check_output(['git', 'describe', '--always', '--dirty']).strip()
+	except Exception:
+		return None
+
+@inlineCallbacks
+def runBenchmark(window):
+	bench = Benchmark()
+	instrument(window, bench)
+
+	cases = []
+	for size in args.sizes.split(','):
+		(dx, dy) = [int(n) for n in size.split('x')]
+		for kinFrames in [int(n) for n in args.kin_frames.split(',')]:
+			for acqLength in [int(n) for n in args.acq_length.split(',')]:
+				cases.append(OrderedDict([('dx', dx), ('dy', dy), ('kinFrames', kinFrames), ('acqLength', acqLength)]))
+
+	results = OrderedDict()
+	results['version'] = gitVersion()
+	results['timestamp'] = time.strftime("%Y-%m-%d %H:%M:%S")
+	results['host'] = platform.node()
+	results['settings'] = vars(args)
+	results['cases'] = []
+	try:
+		for case in cases:
+			print("Running {}".format(dict(case)))
+			result = yield runCase(window, bench, case)
+			results['cases'].append(result)
+			print("  {} shots, {:.2f} shots/s".format(result['shots'], result.get('shotsPerSecond', 0)))
+			for (stage, s) in result['stages'].items():
+				print("  {:<24} p50 {:8.1f} ms   p95 {:8.1f} ms".format(stage, s['p50_ms'], s['p95_ms']))
+	finally:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=2)
+		print("Results written to " + args.output)
+		window.close()
+
+if __name__ == '__main__':
+	a = QtGui.QApplication(sys.argv[:1])
+	a.setQuitOnLastWindowClosed(True)
+	window = MainWindow(reactor, cameraIndex=0)
+	window.show()
+
+	reactor.callWhenRunning(runBenchmark, window)
+	reactor.runReturn()
+	sys.exit(a.exec_())
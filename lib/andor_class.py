@@ -1,12 +1,18 @@
 import sys
+import json
 import numpy as np
 import PyQt4
-
-sys.path.append('./sdk2/')
-import atmcd
+from ctypes import c_int, c_ushort, c_ulong, byref, POINTER
 
 from andor_helpers import *
 
+# The simulated camera stands in for the SDK wrapper when KRBCAM_SIMULATE is set
+if KRBCAM_SIMULATE:
+	import sim_atmcd as atmcd
+else:
+	sys.path.append('./sdk2/')
+	import atmcd
+
 # Base class for Andor Camera
 class KRbiXon(atmcd.atmcd):
 	# Caps struct defined in atmcd.py
@@ -21,6 +27,7 @@ class KRbiXon(atmcd.atmcd):
 		'emGainRange': [0, 0], # {emLow, emHigh}
 		'temperatureRange': [20, 20], # {mintemp, maxtemp}
 		'vss': [], # Vertical shift speeds
+		'vssModes': {}, # Vertical shift speeds of the fast kinetics ('fk') and other ('image') modes
 		'hss': [], # Horizontal shift speeds
 		'hssPreAmp': [], # Pre amp gain availability
 		'preAmpGain': [], # Pre amp gain values
@@ -28,9 +35,19 @@ class KRbiXon(atmcd.atmcd):
 	}
 	errorFlag = 0
 
+	# camInfo keys that are kept in the capability cache
+	cachedCaps = ['detDim', 'internalShutter', 'shutterMinT', 'temperatureRange',
+		'vssModes', 'hss', 'hssPreAmp', 'preAmpGain', 'adChannels']
+
 	def __init__(self):
 		super(KRbiXon, self).__init__()
 
+		# Arguments of the setters last applied to the camera, keyed by setter name,
+		# and answers to timing queries made since the last setter call
+		# See applySetting and cachedQuery
+		self.appliedState = {}
+		self.queryCache = {}
+
 	# Try to stop acquisition, etc. before exiting the SDK
 	# Ensure that SDK is shut down before the program ends
 	def __del__(self):
@@ -55,12 +72,13 @@ class KRbiXon(atmcd.atmcd):
 
 		try:
 			# Ensure that internal shutter is closed for safety!
-			ret = self.SetShutter(1, 2, 0, 0)
+			ret = self.closeShutter()
 			msg += self.handleErrors(ret, "SetShutter error: ", "Shutter closed.\n")
 		except:
 			pass
 
 		# Shut down the SDK
+		self.resetAppliedState()
 		ret = self.ShutDown()
 		msg += self.handleErrors(ret, "ShutDown error: ", "SDK shut down successfully.\n")
 
@@ -68,7 +86,13 @@ class KRbiXon(atmcd.atmcd):
 
 	# Initialize SDK, check camera capabilities, get basic info (stored in camInfo)
 	# Set fan mode for cooler
-	def initializeSDK(self):
+	#
+	# Returns the serial number of each camera by camera index (0 if it couldn't be read)
+	# Reading a serial number means initializing the camera, which takes seconds,
+	# so serials are cached by camera handle in KRBCAM_CAMERA_CACHE_FILE and only
+	# cameras missing from the cache are probed. With useCache False, all cameras are probed.
+	# Cached serials may be out of date, and the camera may be in use, so check them when selecting (see readCameraSerial)
+	def initializeSDK(self, useCache=True):
 		self.errorFlag = 0
 		msg = ""
 
@@ -77,19 +101,73 @@ class KRbiXon(atmcd.atmcd):
 		successMsg = str(nCameras) + " are available.\n"
 		msg += self.handleErrors(ret, "GetAvailableCameras error: ", successMsg)
 
+		if useCache:
+			cache = self.loadCache(KRBCAM_CAMERA_CACHE_FILE)
+		else:
+			cache = {}
+
+		# Did any of the serials come from the cache?
+		self.serialsFromCache = False
+
 		serials = []
 		for i in range(nCameras):
+			(ret, handle) = self.GetCameraHandle(i)
+			key = str(handle)
+
+			if ret == self.DRV_SUCCESS and cache.get(key):
+				serials.append(cache[key])
+				self.serialsFromCache = True
+				continue
+
 			self.selectCamera(i)
 			(errf, ser, errm) = self.getCameraSerial(True)
 
-			if not errf:
-				serials.append(ser)
+			if errf:
+				ser = 0
+			# A camera in use by another instance of the SDK reads 0, don't remember that
+			if ser and ret == self.DRV_SUCCESS:
+				cache[key] = ser
+			serials.append(ser)
+
+		self.saveCache(KRBCAM_CAMERA_CACHE_FILE, cache)
+		if self.serialsFromCache:
+			msg += "Camera serial numbers read from " + KRBCAM_CAMERA_CACHE_FILE + ".\n"
 
 		return (self.errorFlag, serials, msg)
 
+	# JSON caches kept from previous runs:
+	# the camera cache (camera handle -> serial number)
+	# and the capability cache (serial number -> camera capabilities)
+	def loadCache(self, path):
+		try:
+			with open(path) as f:
+				return json.load(f)
+		except (IOError, ValueError):
+			return {}
+
+	def saveCache(self, path, cache):
+		try:
+			with open(path, 'w') as f:
+				json.dump(cache, f)
+		except IOError as e:
+			print("Could not save cache {}: {}".format(path, e))
+
+	# Serial number of the initialized camera
+	# 0 if it can't be read, e.g. when the camera is in use by another instance of the SDK
+	def readCameraSerial(self):
+		(ret, serial) = self.GetCameraSerialNumber()
+		if ret != self.DRV_SUCCESS:
+			return 0
+		return serial
+
 	def initializeCamera(self):
+		# A freshly initialized camera starts from its default settings
+		self.resetAppliedState()
 		ret = self.Initialize("/usr/local/etc/andor") #initialise camera
 		msg = self.handleErrors(ret, "Init. error: ", "SDK initialized.\n")
+		# A camera in use by another instance of the SDK fails here
+		if ret != self.DRV_SUCCESS:
+			return (1, msg)
 		return (self.errorFlag, msg)
 
 	# Select camera by index
@@ -100,6 +178,8 @@ class KRbiXon(atmcd.atmcd):
 		msg += self.handleErrors(ret, "GetCameraHandle error: ", "")
 
 		# Switch to camera
+		# Settings applied to the previous camera don't carry over
+		self.resetAppliedState()
 		ret = self.SetCurrentCamera(handle)
 		successMsg = "Current camera set to " + str(index) + ".\n"
 		msg += self.handleErrors(ret, "SetCurrentCamera error: ", successMsg)
@@ -126,10 +206,18 @@ class KRbiXon(atmcd.atmcd):
 				msg += self.handleErrors(ret, "ShutDown error: ", "SDK shut down successfully.\n")
 
 			return (self.errorFlag, serial, msg)
+		# Couldn't initialize, e.g. the camera is in use: the serial number reads 0
 		else:
-			return (self.errorFlag, -1, msg)
-
-	def setupCamera(self):
+			return (1, 0, msg + errm)
+
+	# Read the camera capabilities into camInfo
+	#
+	# Enumerating the shift speeds and pre amp gains takes hundreds of SDK calls,
+	# so the results are kept in the capability cache, per serial number.
+	# A cache entry is only used if the head model and SDK version still match;
+	# refresh=True reads everything from the camera again.
+	def setupCamera(self, serial=None, refresh=False):
+		self.errorFlag = 0
 		msg = ""
 
 		# Get capabilities structure
@@ -140,13 +228,78 @@ class KRbiXon(atmcd.atmcd):
 		(ret, self.camInfo['model']) = self.GetHeadModel()
 		successMsg = "Head model is " + str(self.camInfo['model']) + ".\n"
 		msg += self.handleErrors(ret, "GetHeadModel error: ", successMsg)
-		
+		modelRead = ret == self.DRV_SUCCESS
+
+		# Set fan mode for cooling
+		ret = self.SetFanMode(KRBCAM_FAN_MODE)
+		if KRBCAM_FAN_MODE == 0:
+			successMsg = "Fan set to full.\n"
+		elif KRBCAM_FAN_MODE == 1:
+			successMsg = "Fan set to low.\n"
+		elif KRBCAM_FAN_MODE == 2:
+			successMsg = "Fan turned off.\n"
+		msg += self.handleErrors(ret, "SetFanMode error: ", successMsg)
+
+		version = self.getSDKVersion()
+		cache = self.loadCache(KRBCAM_CAPS_CACHE_FILE)
+		entry = cache.get(str(serial))
+
+		self.capsFromCache = False
+		if (not refresh and entry and modelRead and version is not None
+				and entry['model'] == self.camInfo['model'] and entry['sdkVersion'] == version):
+			for key in self.cachedCaps:
+				self.camInfo[key] = entry['camInfo'][key]
+			self.capsFromCache = True
+			msg += "Camera capabilities read from " + KRBCAM_CAPS_CACHE_FILE + ".\n"
+		else:
+			(errf, errm) = self.readCapabilities()
+			msg += errm
+			if errf:
+				self.errorFlag = 1
+
+			# Don't remember a partial read
+			if serial is not None and modelRead and version is not None and not errf:
+				cache[str(serial)] = {
+					'model': self.camInfo['model'],
+					'sdkVersion': version,
+					'camInfo': dict((key, self.camInfo[key]) for key in self.cachedCaps)
+				}
+				self.saveCache(KRBCAM_CAPS_CACHE_FILE, cache)
+
+		# Get vertical shift speeds
+		(err, err_msg) = self.updateVerticalShiftSpeeds(KRBCAM_ACQ_MODE)
+		msg += err_msg
+
+		# Return (errorFlag, msg)
+		# If error, then errorFlag = 1, and msg will contain the error message
+		# If no error, then errorFlag = 0, and msg contains the success messages
+		return (self.errorFlag, msg)
+
+	# SDK version, as a list of (EPROM, COF file, driver revision, driver version, DLL revision, DLL version)
+	# None if it can't be read
+	def getSDKVersion(self):
+		result = self.GetSoftwareVersion()
+		if result[0] != self.DRV_SUCCESS:
+			return None
+		return list(result[1:])
+
+	# Query the camera for everything in cachedCaps
+	# Returns (errorFlag, msg); errorFlag = 1 if any of the queries failed
+	def readCapabilities(self):
+		msg = ""
+
+		# handleErrors only builds the message, so note failed queries here
+		failed = []
+		def check(ret, errMsg, successMsg):
+			if ret != self.DRV_SUCCESS:
+				failed.append(errMsg)
+			return self.handleErrors(ret, errMsg, successMsg)
+
 		# Get detector dimensions
 		(ret, dim0, dim1) = self.GetDetector()
-		self.camInfo['detDim'][0] = dim0
-		self.camInfo['detDim'][1] = dim1
+		self.camInfo['detDim'] = [dim0, dim1]
 		successMsg = "Array is " + str(dim0) + " x " + str(dim1) + " pixels.\n"
-		msg += self.handleErrors(ret, "GetDetector error: ", successMsg)
+		msg += check(ret, "GetDetector error: ", successMsg)
 		
 		# Get internal shutter specs
 		(ret, self.camInfo['internalShutter']) = self.IsInternalMechanicalShutter()
@@ -154,48 +307,41 @@ class KRbiXon(atmcd.atmcd):
 			successMsg = "Has internal shutter.\n"
 		else:
 			successMsg = "No internal shutter.\n"
-		msg += self.handleErrors(ret, "IsInternalMechanicalShutter error: ", successMsg)
+		msg += check(ret, "IsInternalMechanicalShutter error: ", successMsg)
 		
 		# Get internal shutter specs
 		(ret, minT, maxT) = self.GetShutterMinTimes()
-		self.camInfo['shutterMinT'][0] = minT
-		self.camInfo['shutterMinT'][1] = maxT
+		self.camInfo['shutterMinT'] = [minT, maxT]
 		successMsg = "Minimum shutter closing (opening) time (ms): " + str(minT) + " (" + str(maxT) + ").\n"
-		msg += self.handleErrors(ret, "GetShutterMinTimes error: ", successMsg)
+		msg += check(ret, "GetShutterMinTimes error: ", successMsg)
 
 		# Get allowed temperature range
 		(ret, mintemp, maxtemp) = self.GetTemperatureRange()
-		self.camInfo['temperatureRange'][0] = mintemp
-		self.camInfo['temperatureRange'][1] = maxtemp
+		self.camInfo['temperatureRange'] = [mintemp, maxtemp]
 		successMsg = "Allowed temperature range is {} to {} degrees celsius.\n".format(mintemp, maxtemp)
-		msg += self.handleErrors(ret, "GetTemperatureRange error: ", successMsg)
+		msg += check(ret, "GetTemperatureRange error: ", successMsg)
 
-		# Set fan mode for cooling
-		ret = self.SetFanMode(KRBCAM_FAN_MODE)
-		if KRBCAM_FAN_MODE == 0:
-			successMsg = "Fan set to full.\n"
-		elif KRBCAM_FAN_MODE == 1:
-			successMsg = "Fan set to low.\n"
-		elif KRBCAM_FAN_MODE == 2:
-			successMsg = "Fan turned off.\n"
-		msg += self.handleErrors(ret, "SetFanMode error: ", successMsg)
-
-		# Get vertical shift speeds
-		(err, err_msg) = self.updateVerticalShiftSpeeds(KRBCAM_ACQ_MODE)
-		msg += err_msg
+		# Get vertical shift speeds for both fast kinetics and image modes
+		self.camInfo['vssModes'] = {}
+		for mode in [KRBCAM_ACQ_MODE_FK, KRBCAM_ACQ_MODE_SINGLE]:
+			(err, err_msg) = self.updateVerticalShiftSpeeds(mode)
+			msg += err_msg
+			if err:
+				failed.append(err_msg)
 
 		(ret, nad) = self.GetNumberADChannels()
 		successMsg = "Number of A/D channels is " + str(nad) + ".\n"
-		msg += self.handleErrors(ret, "GetNumberADChannels error: ", successMsg)
+		msg += check(ret, "GetNumberADChannels error: ", successMsg)
 		self.camInfo['adChannels'] = nad
 
 		(ret, npreamp) = self.GetNumberPreAmpGains()
 		successMsg = "Number of preamp gains is " + str(npreamp) + ".\n"
-		msg += self.handleErrors(ret, "GetNumberPreAmpGains error: ", successMsg)
+		msg += check(ret, "GetNumberPreAmpGains error: ", successMsg)
+		self.camInfo['preAmpGain'] = []
 		for j in range(npreamp):
 			(ret, gain) = self.GetPreAmpGain(j)
 			successMsg = "Preamp gain " + str(j) + " is {:.3}.\n".format(gain)
-			msg += self.handleErrors(ret, "GetPreAmpGain error: ", successMsg)
+			msg += check(ret, "GetPreAmpGain error: ", successMsg)
 			self.camInfo['preAmpGain'].append(gain)
 
 		hss_top_amp = []
@@ -206,14 +352,14 @@ class KRbiXon(atmcd.atmcd):
 			for j in range(2):
 				(ret, numhss) = self.GetNumberHSSpeeds(i,j)
 				successMsg = "Number of HS speeds ({}, {}): {}.\n".format(i,j,numhss)
-				msg += self.handleErrors(ret, "GetNumberHSSpeeds error: ", successMsg)
+				msg += check(ret, "GetNumberHSSpeeds error: ", successMsg)
 
 				hss_amp = []
 				hss_val = []
 				for k in range(numhss):
 					(ret, speed) = self.GetHSSpeed(i,j,k)
 					successMsg = "({},{},{}) speed: {:.1f} MHz.\n".format(i,j,k,speed)
-					msg += self.handleErrors(ret, "GetHSSpeed error: ", successMsg)
+					msg += check(ret, "GetHSSpeed error: ", successMsg)
 
 					hss_val.append(speed)
 
@@ -221,7 +367,7 @@ class KRbiXon(atmcd.atmcd):
 					for m in range(len(self.camInfo['preAmpGain'])):
 						(ret, available) = self.IsPreAmpGainAvailable(i,j,k,m)
 						successMsg = "({},{},{},{}): {}\n".format(i,j,k,m,available)
-						msg += self.handleErrors(ret, "IsPreAmpGainAvailble error: ", successMsg)
+						msg += check(ret, "IsPreAmpGainAvailble error: ", successMsg)
 						preamp.append(available)
 					hss_amp.append(preamp)
 
@@ -232,39 +378,51 @@ class KRbiXon(atmcd.atmcd):
 		self.camInfo['hss'] = hss_top_val
 		self.camInfo['hssPreAmp'] = hss_top_amp
 
-
-		# Return (errorFlag, msg)
-		# If error, then errorFlag = 1, and msg will contain the error message
-		# If no error, then errorFlag = 0, and msg contains the success messages
-		return (self.errorFlag, msg)
+		return (1 if failed else 0, msg)
 
 	# Get vertical shift speeds
+	# Each mode's speeds are only read from the camera once, after that they come from camInfo['vssModes']
+	# Returns (errorFlag, msg); speeds that couldn't all be read aren't kept in vssModes
 	def updateVerticalShiftSpeeds(self, acq_mode):
 		msg = ""
+		errf = 0
+
+		key = 'fk' if acq_mode == 4 else 'image'
+		if self.camInfo['vssModes'].has_key(key):
+			self.camInfo['vss'] = list(self.camInfo['vssModes'][key])
+			return (0, msg)
 
 		if acq_mode == 4: # Fast kinetics
 			(ret, numvss) = self.GetNumberFKVShiftSpeeds()
 			successMsg = "Number of fast kinetics VS speeds is " + str(numvss) + ".\n"
 			msg += self.handleErrors(ret, "GetNumberFKVShiftSpeeds error: ", successMsg)
+			errf = errf or ret != self.DRV_SUCCESS
 			self.camInfo['vss'] = []
 
 			for i in range(numvss):
 				(ret, speed) = self.GetFKVShiftSpeedF(i)
 				successMsg = "Speed " + str(i) + " is {:.3} microseconds.\n".format(speed)
 				msg += self.handleErrors(ret, "GetFKVShiftSpeedF error: ", successMsg)
+				errf = errf or ret != self.DRV_SUCCESS
 				self.camInfo['vss'].append(speed)
 		else:
 			(ret, numvss) = self.GetNumberVSSpeeds()
 			successMsg = "Number of vertical shift speeds is " + str(numvss) + ".\n"
 			msg += self.handleErrors(ret, "GetNumberVSSpeeds error: ", successMsg)
+			errf = errf or ret != self.DRV_SUCCESS
 			self.camInfo['vss'] = []
 
 			for i in range(numvss):
 				(ret, speed) = self.GetVSSpeed(i)
 				successMsg = "Speed " + str(i) + " is {:.3} microseconds.\n".format(speed)
 				msg += self.handleErrors(ret, "GetVSSpeed error: ", successMsg)
+				errf = errf or ret != self.DRV_SUCCESS
 				self.camInfo['vss'].append(speed)
-		return (self.errorFlag, msg)
+
+		if errf:
+			return (1, msg)
+		self.camInfo['vssModes'][key] = list(self.camInfo['vss'])
+		return (0, msg)
 
 
 
@@ -273,41 +431,34 @@ class KRbiXon(atmcd.atmcd):
 		self.errorFlag = 0
 		msg = ""
 
-		ret = self.SetReadMode(KRBCAM_READ_MODE)
 		successMsg = "Read mode set to " + read_modes[str(KRBCAM_READ_MODE)] + ".\n"
-		msg += self.handleErrors(ret, "SetReadMode error: ", successMsg)
+		msg += self.applySetting(self.SetReadMode, (KRBCAM_READ_MODE,), "SetReadMode error: ", successMsg)
 
 		if KRBCAM_USE_INTERNAL_SHUTTER:
-			ret = self.SetShutter(1, KRBCAM_USE_INTERNAL_SHUTTER, self.camInfo['shutterMinT'][0], self.camInfo['shutterMinT'][1])
 			successMsg = "Shutter mode set to " + shutter_modes[str(KRBCAM_USE_INTERNAL_SHUTTER)] + ".\n"
-			msg += self.handleErrors(ret, "SetShutter error: ", successMsg)
+			msg += self.applySetting(self.SetShutter, (1, KRBCAM_USE_INTERNAL_SHUTTER, self.camInfo['shutterMinT'][0], self.camInfo['shutterMinT'][1]), "SetShutter error: ", successMsg)
 		else:
-			ret = self.SetShutter(1, KRBCAM_USE_INTERNAL_SHUTTER, 0, 0)
 			successMsg = "Shutter mode set to " + shutter_modes[str(KRBCAM_USE_INTERNAL_SHUTTER)] + ".\n"
-			msg += self.handleErrors(ret, "SetShutter error: ", successMsg)
+			msg += self.applySetting(self.SetShutter, (1, KRBCAM_USE_INTERNAL_SHUTTER, 0, 0), "SetShutter error: ", successMsg)
 
-		ret = self.SetTriggerMode(KRBCAM_TRIGGER_MODE)
 		successMsg = "Trigger mode set to " + trigger_modes[str(KRBCAM_TRIGGER_MODE)] + ".\n"
-		msg += self.handleErrors(ret, "SetTriggerMode error: ", successMsg)
+		msg += self.applySetting(self.SetTriggerMode, (KRBCAM_TRIGGER_MODE,), "SetTriggerMode error: ", successMsg)
 
 		if KRBCAM_USE_INTERNAL_SHUTTER: # == 1 if using external shutter
-			ret = self.SetFastExtTrigger(1)
 			successMsg = "Trigger set to Fast External Trigger mode.\n"
-			msg += self.handleErrors(ret, "SetFastExtTrigger error: ", successMsg)
+			msg += self.applySetting(self.SetFastExtTrigger, (1,), "SetFastExtTrigger error: ", successMsg)
 
 
-		ret = self.SetEMGainMode(KRBCAM_EM_MODE)
 		successMsg = "EM mode set to " + em_modes[str(KRBCAM_EM_MODE)] + ".\n"
-		msg += self.handleErrors(ret, "SetEMGainMode error: ", successMsg)
+		msg += self.applySetting(self.SetEMGainMode, (KRBCAM_EM_MODE,), "SetEMGainMode error: ", successMsg)
 
-		ret = self.SetEMAdvanced(KRBCAM_EM_ADVANCED)
 		if KRBCAM_EM_ADVANCED:
 			successMsg = "Access to EM gain of >300x is enabled.\n"
 		else:
 			successMsg = "Access to EM gain of >300x is disabled.\n"
-		msg += self.handleErrors(ret, "SetEMAdvanced error: ", successMsg)
+		msg += self.applySetting(self.SetEMAdvanced, (KRBCAM_EM_ADVANCED,), "SetEMAdvanced error: ", successMsg)
 
-		(ret, range0, range1) = self.GetEMGainRange()
+		(ret, range0, range1) = self.cachedQuery(self.GetEMGainRange)
 		self.camInfo['emGainRange'][0] = range0
 		self.camInfo['emGainRange'][1] = range1
 
@@ -315,10 +466,19 @@ class KRbiXon(atmcd.atmcd):
 
 
 	# Get data from camera
-	def getData(self, dataLength):
+	# The images are written in place into out, a numpy array owned by the caller
+	# out must be C-contiguous and hold exactly the images in the series,
+	# e.g. shape (kinFrames, rows, columns). Returns out itself, not a copy.
+	# int32 buffers are read with GetImages, uint16 buffers with GetImages16
+	def getData(self, out):
 		self.errorFlag = 0
 		msg = ""
 
+		if out.dtype not in (np.int32, np.uint16) or not out.flags['C_CONTIGUOUS']:
+			self.errorFlag = 1
+			msg += "getData error: readout buffer must be C-contiguous int32 or uint16.\n"
+			return (self.errorFlag, msg, out)
+
 		# Query camera for the number of available images
 		# For our typical use, should be the number of images in the kinetic series
 		# e.g., for imaging K and Rb one shot each it should be 2
@@ -327,12 +487,48 @@ class KRbiXon(atmcd.atmcd):
 		msg += self.handleErrors(ret, "GetNumberAvailableImages error: ", successMsg)
 
 		# Read the images off of the camera
-		# Note that "data" is a ctypes array of longs
-		# This needs to be converted later into something python can use
-		(ret, data, validfirst, validlast) = self.GetImages(first, last, dataLength)
-		msg += self.handleErrors(ret, "GetImages error: ", "Readout complete!\n")
+		# Pass the data pointer of out straight to the SDK, so nothing is copied
+		validfirst = c_int()
+		validlast = c_int()
+		if out.dtype == np.uint16:
+			ret = self.dll.GetImages16(c_int(first), c_int(last), out.ctypes.data_as(POINTER(c_ushort)),
+				c_ulong(out.size), byref(validfirst), byref(validlast))
+			msg += self.handleErrors(ret, "GetImages16 error: ", "Readout complete!\n")
+		else:
+			ret = self.dll.GetImages(c_int(first), c_int(last), out.ctypes.data_as(POINTER(c_int)),
+				c_ulong(out.size), byref(validfirst), byref(validlast))
+			msg += self.handleErrors(ret, "GetImages error: ", "Readout complete!\n")
+		if ret != self.DRV_SUCCESS:
+			self.errorFlag = 1
+
+		return (self.errorFlag, msg, out)
+
+	# Get the oldest image waiting in the circular buffer (Run till Abort)
+	# Like getData, the image is written in place into out (C-contiguous int32 or uint16)
+	# Returns (errorFlag, msg, newImage); newImage is False if no image was waiting
+	def getOldestImage(self, out):
+		self.errorFlag = 0
+		msg = ""
+
+		if out.dtype not in (np.int32, np.uint16) or not out.flags['C_CONTIGUOUS']:
+			self.errorFlag = 1
+			msg += "getOldestImage error: readout buffer must be C-contiguous int32 or uint16.\n"
+			return (self.errorFlag, msg, False)
+
+		if out.dtype == np.uint16:
+			ret = self.dll.GetOldestImage16(out.ctypes.data_as(POINTER(c_ushort)), c_ulong(out.size))
+		else:
+			ret = self.dll.GetOldestImage(out.ctypes.data_as(POINTER(c_int)), c_ulong(out.size))
 
-		return (self.errorFlag, msg, data)
+		if ret == self.DRV_NO_NEW_DATA:
+			return (self.errorFlag, msg, False)
+
+		msg += self.handleErrors(ret, "GetOldestImage error: ", "Readout complete!\n")
+		if ret != self.DRV_SUCCESS:
+			self.errorFlag = 1
+			return (self.errorFlag, msg, False)
+
+		return (self.errorFlag, msg, True)
 
 	# For convenience in error checking
 	def handleErrors(self, errorCode, msg = "", successMsg = ""):
@@ -374,6 +570,57 @@ class KRbiXon(atmcd.atmcd):
 		errorFlag = 1
 		return msg
 
+	# Call an SDK setter, unless it was already called with the same arguments
+	# setter is the bound SDK method, e.g. self.SetReadMode, and args its arguments as a tuple
+	# Returns the message from handleErrors, or "" if nothing needed to be sent
+	def applySetting(self, setter, args, msg = "", successMsg = ""):
+		name = setter.__name__
+		if self.appliedState.get(name) == args:
+			return ""
+
+		# Changing the acquisition mode may reset the mode-specific settings,
+		# so send everything again after a mode change
+		if name == 'SetAcquisitionMode':
+			self.appliedState = {}
+
+		ret = setter(*args)
+		if ret == self.DRV_SUCCESS:
+			self.appliedState[name] = args
+		else:
+			self.appliedState.pop(name, None)
+
+		# Timings depend on the settings, so they need to be queried again
+		self.queryCache = {}
+
+		return self.handleErrors(ret, msg, successMsg)
+
+	# Run an SDK query that takes no arguments, e.g. self.GetAcquisitionTimings
+	# The answer is reused until a setter is actually sent to the camera
+	def cachedQuery(self, query):
+		name = query.__name__
+		if name not in self.queryCache:
+			result = query()
+			if result[0] != self.DRV_SUCCESS:
+				return result
+			self.queryCache[name] = result
+		return self.queryCache[name]
+
+	# Forget the applied settings, so that the next arm sends every setter again
+	def resetAppliedState(self):
+		self.appliedState = {}
+		self.queryCache = {}
+
+	# Close the internal shutter, e.g. when aborting an acquisition
+	# Recorded like any other setting, so the next arm opens it again
+	def closeShutter(self):
+		args = (1, 2, 0, 0)
+		ret = self.SetShutter(*args)
+		if ret == self.DRV_SUCCESS:
+			self.appliedState['SetShutter'] = args
+		else:
+			self.appliedState.pop('SetShutter', None)
+		return ret
+
 	# Set EM gain, AD channel, shift speeds, pre amp gain
 	def setupAcquisition(self, config):
 		self.errorFlag = 0
@@ -381,24 +628,20 @@ class KRbiXon(atmcd.atmcd):
 
 		# If EM, need to use EMCCD gain register and set EMCCD gain
 		if config['emEnable']:
-			ret = self.SetOutputAmplifier(0)
 			successMsg = "Output amplifier set to EMCCD gain register.\n"
-			msg += self.handleErrors(ret, "SetOutputAmplifier error: ", successMsg)
+			msg += self.applySetting(self.SetOutputAmplifier, (0,), "SetOutputAmplifier error: ", successMsg)
 
 
-			ret = self.SetEMCCDGain(config['emGain'])
 			successMsg = "EM Gain set to " + str(config['emGain']) + ".\n"
-			msg += self.handleErrors(ret, "SetEMCCDGain error: ", successMsg)
+			msg += self.applySetting(self.SetEMCCDGain, (config['emGain'],), "SetEMCCDGain error: ", successMsg)
 		# Otherwise, use the Conventional amplifier
 		else:
-			ret = self.SetOutputAmplifier(1)
 			successMsg = "Output amplifier set to conventional.\n"
-			msg += self.handleErrors(ret, "SetOutputAmplifier error: ", successMsg)
+			msg += self.applySetting(self.SetOutputAmplifier, (1,), "SetOutputAmplifier error: ", successMsg)
 
 		# Set the AD channel
-		ret = self.SetADChannel(config['adChannel'])
 		successMsg = "AD Channel {} selected.\n".format(config['adChannel'])
-		msg += self.handleErrors(ret, "SetADChannel error: ", successMsg)
+		msg += self.applySetting(self.SetADChannel, (config['adChannel'],), "SetADChannel error: ", successMsg)
 
 		# Set the horizontal shift speed
 
@@ -406,15 +649,13 @@ class KRbiXon(atmcd.atmcd):
 		if config['emEnable']:
 			typ = 0
 		hss = config['hss']
-		ret = self.SetHSSpeed(typ, config['hss'])
 		successMsg = "HShiftSpeed set to {}.\n".format(self.camInfo['hss'][0][typ][hss])
-		msg += self.handleErrors(ret, "SetHSSpeed error: ", successMsg)
+		msg += self.applySetting(self.SetHSSpeed, (typ, config['hss']), "SetHSSpeed error: ", successMsg)
 
 		# Set the pre amp gain
 		pa = config['preAmpGain']
-		ret = self.SetPreAmpGain(pa)
 		successMsg = "Pre-Amp Gain set to {}.\n".format(self.camInfo['preAmpGain'][pa])
-		msg += self.handleErrors(ret, "SetPreAmpGain error: ", successMsg)
+		msg += self.applySetting(self.SetPreAmpGain, (pa,), "SetPreAmpGain error: ", successMsg)
 
 		return (self.errorFlag, msg)
 
@@ -425,14 +666,12 @@ class KRbiXon(atmcd.atmcd):
 		self.errorFlag = 0
 		msg = ""
 
-		ret = self.SetAcquisitionMode(KRBCAM_ACQ_MODE_FK)
 		successMsg = "Acquisition mode set to " + acq_modes[str(KRBCAM_ACQ_MODE_FK)] + ".\n"
-		msg += self.handleErrors(ret, "SetAcquisitionMode error: ", successMsg)
+		msg += self.applySetting(self.SetAcquisitionMode, (KRBCAM_ACQ_MODE_FK,), "SetAcquisitionMode error: ", successMsg)
 		
 		# Set the fast kinetics vertical shift speed
-		(ret) = self.SetFKVShiftSpeed(config['vss'])
 		successMsg = "FKVShiftSpeed set to {}.\n".format(config['vss'])
-		msg += self.handleErrors(ret, "SetFKVShiftSpeed error: ", successMsg)
+		msg += self.applySetting(self.SetFKVShiftSpeed, (config['vss'],), "SetFKVShiftSpeed error: ", successMsg)
 
 		# Set the exposure time
 		exposure = config['expTime'] * 1e-3
@@ -440,26 +679,25 @@ class KRbiXon(atmcd.atmcd):
 			binning = KRBCAM_BIN_SIZE
 		else:
 			binning = 1
-		ret = self.SetFastKineticsEx(config['dy'], config['kinFrames'], exposure, 4, binning, binning, config['yOffset'])
-		msg += self.handleErrors(ret, "SetFastKineticsEx error: ", "Fast Kinetics set.\n")
+		msg += self.applySetting(self.SetFastKineticsEx, (config['dy'], config['kinFrames'], exposure, 4, binning, binning, config['yOffset']), "SetFastKineticsEx error: ", "Fast Kinetics set.\n")
 
 		# Get the FK exposure time
-		(ret, realExp) = self.GetFKExposureTime()
+		(ret, realExp) = self.cachedQuery(self.GetFKExposureTime)
 		successMsg = "Real FK exposure time is {:.3} ms.\n".format(realExp * 1e3)
 		msg += self.handleErrors(ret, "GetFKExposureTime error: ", successMsg)
 
 		# Get the Acquisition timings
-		(ret, realExp, realAcc, realKin) = self.GetAcquisitionTimings()
+		(ret, realExp, realAcc, realKin) = self.cachedQuery(self.GetAcquisitionTimings)
 		successMsg = "Real (exp., acc., kin.) times are ({:.3}, {:.3}, {:.3}) ms.\n".format(realExp * 1.0e3, realAcc * 1.0e3, realKin * 1.0e3)
 		msg += self.handleErrors(ret, "GetAcquisitionTimings error: ", successMsg)
 
 		# Get the keep clean time
-		(ret, keepclean) = self.GetKeepCleanTime()
+		(ret, keepclean) = self.cachedQuery(self.GetKeepCleanTime)
 		successMsg = "Keep clean time is {:.3} ms.\n".format(keepclean * 1.0e3)
 		msg += self.handleErrors(ret, "GetKeepCleanTime error: ", successMsg)
 
 		# Get the readout time
-		(ret, readout) = self.GetReadOutTime()
+		(ret, readout) = self.cachedQuery(self.GetReadOutTime)
 		successMsg = "Readout time is {:.3} ms.\n".format(readout * 1.0e3)
 		msg += self.handleErrors(ret, "GetReadoutTime error: ", successMsg)
 
@@ -470,14 +708,12 @@ class KRbiXon(atmcd.atmcd):
 		self.errorFlag = 0
 		msg = ""
 
-		ret = self.SetAcquisitionMode(KRBCAM_ACQ_MODE_SINGLE)
 		successMsg = "Acquisition mode set to " + acq_modes[str(KRBCAM_ACQ_MODE_SINGLE)] + ".\n"
-		msg += self.handleErrors(ret, "SetAcquisitionMode error: ", successMsg)
+		msg += self.applySetting(self.SetAcquisitionMode, (KRBCAM_ACQ_MODE_SINGLE,), "SetAcquisitionMode error: ", successMsg)
 
 		# Set the vertical shift speed
-		(ret) = self.SetVSSpeed(config['vss'])
 		successMsg = "Vertical shift speed set to {}.\n".format(config['vss'])
-		msg += self.handleErrors(ret, "SetVSSpeed error: ", successMsg)
+		msg += self.applySetting(self.SetVSSpeed, (config['vss'],), "SetVSSpeed error: ", successMsg)
 	
 		# Set the exposure time
 		exposure = config['expTime'] * 1e-3
@@ -485,28 +721,90 @@ class KRbiXon(atmcd.atmcd):
 			binning = KRBCAM_BIN_SIZE
 		else:
 			binning = 1
-		ret = self.SetExposureTime(exposure)
-		msg += self.handleErrors(ret, "SetExposureTime error: ", "Exposure time set.\n")
+		msg += self.applySetting(self.SetExposureTime, (exposure,), "SetExposureTime error: ", "Exposure time set.\n")
 
 		hstart = config['xOffset'] + 1
 		hend = config['xOffset'] + config['dx']
 		vstart = config['yOffset'] + 1
 		vend = config['yOffset'] + config['dy']
-		ret = self.SetImage(binning, binning, hstart, hend, vstart, vend)
-		msg += self.handleErrors(ret, "SetImage error: ", "Image bounds set.\n")
+		msg += self.applySetting(self.SetImage, (binning, binning, hstart, hend, vstart, vend), "SetImage error: ", "Image bounds set.\n")
 
 		# Get the Acquisition timings
-		(ret, realExp, realAcc, realKin) = self.GetAcquisitionTimings()
+		(ret, realExp, realAcc, realKin) = self.cachedQuery(self.GetAcquisitionTimings)
 		successMsg = "Real (exp., acc., kin.) times are ({:.3}, {:.3}, {:.3}) ms.\n".format(realExp * 1.0e3, realAcc * 1.0e3, realKin * 1.0e3)
 		msg += self.handleErrors(ret, "GetAcquisitionTimings error: ", successMsg)
 
 		# Get the keep clean time
-		(ret, keepclean) = self.GetKeepCleanTime()
+		(ret, keepclean) = self.cachedQuery(self.GetKeepCleanTime)
 		successMsg = "Keep clean time is {} ms.\n".format(keepclean * 1.0e3)
 		msg += self.handleErrors(ret, "GetKeepCleanTime error: ", successMsg)
 
 		# Get the readout time
-		(ret, readout) = self.GetReadOutTime()
+		(ret, readout) = self.cachedQuery(self.GetReadOutTime)
+		successMsg = "Readout time is {:.3} ms.\n".format(readout * 1.0e3)
+		msg += self.handleErrors(ret, "GetReadoutTime error: ", successMsg)
+
+		return (self.errorFlag, msg)
+
+
+	# Have the SDK rotate the images, so they come out of GetImages in display orientation
+	# Returns True if the SDK is rotating the images;
+	# otherwise (not rotating, or the SDK can't) the caller has to rotate the data itself
+	def setupRotation(self, rotate):
+		if not KRBCAM_SDK_ORIENTATION or not hasattr(self, 'SetImageRotate'):
+			return False
+
+		if rotate:
+			rotateArgs = (KRBCAM_SDK_ROTATE,)
+			flipArgs = KRBCAM_SDK_FLIP
+		else:
+			rotateArgs = (0,)
+			flipArgs = (0, 0)
+
+		self.applySetting(self.SetImageRotate, rotateArgs)
+		self.applySetting(self.SetImageFlip, flipArgs)
+
+		# Only count on it if both settings went through
+		return rotate and self.appliedState.get('SetImageRotate') == rotateArgs and self.appliedState.get('SetImageFlip') == flipArgs
+
+	# Set up Run till Abort for streaming single images
+	# The camera is armed once and keeps taking an image on every trigger;
+	# images are pulled off of the circular buffer with getOldestImage
+	def setupStreaming(self, config):
+		self.errorFlag = 0
+		msg = ""
+
+		successMsg = "Acquisition mode set to " + acq_modes[str(KRBCAM_ACQ_MODE_STREAM)] + ".\n"
+		msg += self.applySetting(self.SetAcquisitionMode, (KRBCAM_ACQ_MODE_STREAM,), "SetAcquisitionMode error: ", successMsg)
+
+		# Set the vertical shift speed
+		successMsg = "Vertical shift speed set to {}.\n".format(config['vss'])
+		msg += self.applySetting(self.SetVSSpeed, (config['vss'],), "SetVSSpeed error: ", successMsg)
+
+		# Set the exposure time
+		exposure = config['expTime'] * 1e-3
+		if config['binning']:
+			binning = KRBCAM_BIN_SIZE
+		else:
+			binning = 1
+		msg += self.applySetting(self.SetExposureTime, (exposure,), "SetExposureTime error: ", "Exposure time set.\n")
+
+		# Shortest possible cycle time, the external trigger sets the pace
+		msg += self.applySetting(self.SetKineticCycleTime, (0,), "SetKineticCycleTime error: ", "Kinetic cycle time set.\n")
+
+		hstart = config['xOffset'] + 1
+		hend = config['xOffset'] + config['dx']
+		vstart = config['yOffset'] + 1
+		vend = config['yOffset'] + config['dy']
+		msg += self.applySetting(self.SetImage, (binning, binning, hstart, hend, vstart, vend), "SetImage error: ", "Image bounds set.\n")
+
+		# Get the Acquisition timings
+		(ret, realExp, realAcc, realKin) = self.cachedQuery(self.GetAcquisitionTimings)
+		successMsg = "Real (exp., acc., kin.) times are ({:.3}, {:.3}, {:.3}) ms.\n".format(realExp * 1.0e3, realAcc * 1.0e3, realKin * 1.0e3)
+		msg += self.handleErrors(ret, "GetAcquisitionTimings error: ", successMsg)
+
+		# Get the readout time
+		(ret, readout) = self.cachedQuery(self.GetReadOutTime)
 		successMsg = "Readout time is {:.3} ms.\n".format(readout * 1.0e3)
 		msg += self.handleErrors(ret, "GetReadoutTime error: ", successMsg)
 
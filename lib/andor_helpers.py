@@ -6,9 +6,8 @@
 ## Camera serial numbers ##
 ###########################
 
-with open('./lib/serials.json') as f:
-	from json import load
-	KRBCAM_SERIALS = load(f)
+# Read on first use, see getSerials
+KRBCAM_SERIALS_FILE = './lib/serials.json'
 
 #########################################################################################
 ############# Don't change stuff below this line unless you mean it! ####################
@@ -16,6 +15,7 @@ with open('./lib/serials.json') as f:
 
 KRBCAM_ACQ_MODE_FK = 4					# 4 is Fast kinetics
 KRBCAM_ACQ_MODE_SINGLE = 1				# 1 is Single
+KRBCAM_ACQ_MODE_STREAM = 5				# 5 is Run till Abort, used for streaming single images
 
 KRBCAM_ACQ_MODE = KRBCAM_ACQ_MODE_FK	# 4 is Fast Kinetics
 
@@ -36,6 +36,16 @@ KRBCAM_FK_BINNING_MODE = 4
 KRBCAM_N_ACC = 1
 KRBCAM_BIN_SIZE = 2
 
+# Let the SDK rotate images (SetImageRotate/SetImageFlip) when the image is rotated
+# The settings are meant to give the same orientation as rotating in software (image_processing.rotateFrames),
+# but the SDK counts rows from the bottom left, so its clockwise may be our anticlockwise.
+# Off until a saved file has been compared both ways on the camera; fix ROTATE/FLIP if they differ
+KRBCAM_SDK_ORIENTATION = False
+KRBCAM_SDK_ROTATE = 1					# 0: none, 1: 90 deg clockwise, 2: 90 deg anticlockwise
+KRBCAM_SDK_FLIP = (0, 0)				# (horizontal, vertical), 1 to flip
+
+KRBCAM_MAX_COUNTS_16 = 65535			# Largest count in 16-bit readout mode, pixels at this value have clipped
+
 KRBCAM_DEFAULT_TEMP = -20				# Celsius
 KRBCAM_MIN_TEMP = -70					# Celsius
 KRBCAM_MAX_TEMP = 20					# Celsius
@@ -51,6 +61,27 @@ else:
 KRBCAM_LOOP_ACQ = True					# Loop acquisition?
 KRBCAM_ACQ_TIMEOUT = 20					# seconds
 
+KRBCAM_ACQ_WAIT = True					# Wait for acquisition events in a worker thread instead of polling GetStatus
+KRBCAM_ACQ_WAIT_TIMEOUT = 1000			# ms, longest single WaitForAcquisitionTimeOut call before re-checking status
+
+KRBCAM_SAVE_FORMATS = ['npz', 'npy', 'csv']	# npy is written uncompressed with a .json metadata sidecar
+KRBCAM_SAVE_QUEUE_LENGTH = 4			# Shots waiting to be written before the acquisition loop holds off re-arming
+KRBCAM_SAVE_THREADS = 1					# Writer threads; one keeps files published in shot order
+
+# Per-shot stage timings (lib/shot_metrics.py), turned on with andor_gui.py --metrics
+KRBCAM_METRICS = False					# Time the stages of every shot
+KRBCAM_METRICS_LOG_FILE = 'krbcam_metrics.jsonl'	# One JSON line per shot, written next to the data
+KRBCAM_METRICS_LOG_MAX_BYTES = 1 << 20	# Size at which the log is rolled over to .1
+KRBCAM_METRICS_WINDOW = 100				# Shots summarized in the GUI
+KRBCAM_METRICS_FLUSH_SHOTS = 10			# Shots logged per batch written to the log
+
+# Simulated camera (lib/sim_atmcd.py) instead of the Andor SDK, for testing without hardware
+# Turned on by setting the KRBCAM_SIMULATE environment variable to 1, or with andor_gui.py --simulate
+from os import environ
+KRBCAM_SIMULATE = environ.get('KRBCAM_SIMULATE', '0') not in ('', '0')
+KRBCAM_SIM_TRIGGER_PERIOD = float(environ.get('KRBCAM_SIM_TRIGGER_PERIOD', 0.5))	# s between external triggers of the simulated camera
+KRBCAM_SIM_NOISE_FRAMES = 4				# Noise realizations of each simulated frame
+
 # KRBCAM_FILENAME_BASE_IMAGE = 'ixon_img_'
 # KRBCAM_FILENAME_BASE_FK = 'ixon_'
 
@@ -65,11 +96,11 @@ KRBCAM_N_PLOT_SETTINGS = 2
 
 KRBCAM_LOCAL_SAVE_PATH = 'C:\\Users\\Ye Lab\\Desktop\\KRbCamPython\\data\\'
 
-with open('./lib/ip.txt') as f:
-	ip_str = f.read(100)
-KRBCAM_REMOTE_SAVE_PATH = '\\\\' + ip_str + '\\krbdata\\data\\' # PolarKRB's IP address
+KRBCAM_IP_FILE = './lib/ip.txt' # PolarKRB's IP address, for the remote save path (see getRemoteSavePath)
 KRBCAM_SAVE_PATH_SUFFIX = '{0.year}\\{0:%m}\\{0.year}{0:%m}{0:%d}\\' # e.g. "2019\01\20190101\Andor\"
-KRBCAM_DEFAULT_SAVE_PATH = KRBCAM_REMOTE_SAVE_PATH
+
+KRBCAM_CAMERA_CACHE_FILE = './lib/camera_cache.json'	# Camera handles -> serial numbers, saves initializing every camera on startup
+KRBCAM_CAPS_CACHE_FILE = './lib/caps_cache.json'		# Serial numbers -> camera capabilities, saves enumerating them on startup
 
 KRBCAM_DEFAULT_CONFIG = 'TwoSpeciesFK.json'
 KRBCAM_DEFAULT_CONFIG_VERTICAL = 'TwoSpeciesVertical.json'
@@ -82,15 +113,50 @@ KRBCAM_DEFAULT_CONFIG_VERTICAL = 'TwoSpeciesVertical.json'
 ##### GUI default parameters #####
 ##################################
 
-with open('./lib/config/' + KRBCAM_DEFAULT_CONFIG) as f:
-	from json import load
-	default_config = load(f)
-default_config['savePath'] = KRBCAM_DEFAULT_SAVE_PATH
+# The files in lib/ are read the first time they're needed instead of on import,
+# so importing the helpers doesn't touch the disk
+_loaded = {}
+
+def loadOnce(key, load):
+	if not _loaded.has_key(key):
+		_loaded[key] = load()
+	return _loaded[key]
+
+def readSerials():
+	with open(KRBCAM_SERIALS_FILE) as f:
+		from json import load
+		return load(f)
+
+# Serial number -> camera name
+def getSerials():
+	return loadOnce('serials', readSerials)
+
+def readRemoteSavePath():
+	with open(KRBCAM_IP_FILE) as f:
+		ip_str = f.read(100)
+	return '\\\\' + ip_str + '\\krbdata\\data\\'
+
+def getRemoteSavePath():
+	return loadOnce('remoteSavePath', readRemoteSavePath)
+
+# Return KRBCAM_LOCAL_SAVE_PATH here to save locally by default
+def getDefaultSavePath():
+	return getRemoteSavePath()
+
+def readDefaultConfig():
+	with open('./lib/config/' + KRBCAM_DEFAULT_CONFIG) as f:
+		from json import load
+		config = load(f)
+	config['savePath'] = getDefaultSavePath()
+
+	if not config.has_key('filebase'):
+		config['filebase'] = KRBCAM_DEFAULT_FILENAME_BASE
+	if not config.has_key('saveFolder'):
+		config['saveFolder'] = KRBCAM_DEFAULT_FOLDER
+	return config
 
-if not default_config.has_key('filebase'):
-	default_config['filebase'] = KRBCAM_DEFAULT_FILENAME_BASE
-if not default_config.has_key('saveFolder'):
-	default_config['saveFolder'] = KRBCAM_DEFAULT_FOLDER
+def getDefaultConfig():
+	return loadOnce('defaultConfig', readDefaultConfig)
 
 # default_config = {
 # 	'kinFrames': '2',
@@ -102,7 +168,7 @@ if not default_config.has_key('saveFolder'):
 # 	'dy': str(KRBCAM_EXPOSED_ROWS),
 # 	'emGain': '1',
 # 	'emEnable': False,
-# 	'savePath': KRBCAM_DEFAULT_SAVE_PATH,
+# 	'savePath': getDefaultSavePath(),
 # 	'vss': 3,
 # 	'preAmpGain': 0,
 # 	'adChannel': 0,
@@ -112,6 +178,12 @@ if not default_config.has_key('saveFolder'):
 # }
 
 KRBCAM_AUTOSCALE_PERCENTILES = [0.2, 99.8]
+KRBCAM_AUTOSCALE_MAX_BINS = 1 << 20		# Largest count range autoscaled with a histogram instead of a partition
+KRBCAM_OD_THREADS = 4					# Threads for the OD calculation
+KRBCAM_OD_BLOCK_ROWS = 128				# Rows per block of the OD calculation
+KRBCAM_OD_CACHE_SIZE = 8				# OD images kept around for redrawing without recalculating
+KRBCAM_LIVE_FPS = 20					# Most redraws per second of the image while acquiring
+KRBCAM_LUT_SIZE = 256					# Entries in the colormap lookup tables of the fast live view
 
 #####################################
 ######### Dicts for lookups #########
@@ -0,0 +1,104 @@
+import os
+
+# Keeps track of the next free file number in each save directory
+#
+# Listing the save directory over the network share gets slow as it fills up,
+# so each (directory, file base, extension) is scanned once and cached together
+# with the directory mtime. Later lookups only stat the directory, and rescan
+# if something else has changed it.
+# Our own saves are accounted for with reserve() and published() (or failed()),
+# other files we write there with expectChange() and published().
+# Writing one changes the mtime several times (temp file, sidecar, rename), so while
+# any of our saves to a directory are pending its mtime isn't checked at all;
+# published() takes the new mtime once the last one is in.
+class FileNumberIndex(object):
+	def __init__(self):
+		# (savedir, filebase, ext) -> [directory mtime, next file number]
+		self.entries = {}
+
+		# (savedir, filebase) -> next file number that isn't taken by a pending save
+		self.reserved = {}
+
+		# savedir -> number of our saves still being written there
+		self.pending = {}
+
+	# Next free file number, or None if the directory doesn't exist
+	# Files are saved as filebase + filenumber + ext
+	def nextNumber(self, savedir, filebase, ext):
+		key = (savedir, filebase, ext)
+		entry = self.entries.get(key)
+		if entry is not None and self.pending.get(savedir):
+			return max(entry[1], self.reserved.get((savedir, filebase), 0))
+
+		try:
+			mtime = os.stat(savedir).st_mtime
+		except OSError:
+			return None
+
+		if entry is None or entry[0] != mtime:
+			entry = [mtime, self.scan(savedir, filebase, ext)]
+			self.entries[key] = entry
+
+		return max(entry[1], self.reserved.get((savedir, filebase), 0))
+
+	# List the directory and find the number after the largest one in use
+	def scan(self, savedir, filebase, ext):
+		fileNumber = 0
+		ind1 = len(filebase)
+		for file in os.listdir(savedir):
+			if not file.startswith(filebase):
+				continue
+			ind2 = file.find(ext)
+
+			# Compare file number, if it's bigger than set fileNumber to 1 greater than that
+			try:
+				num = int(file[ind1:ind2])
+				if num >= fileNumber:
+					fileNumber = num + 1
+			except ValueError:
+				pass
+		return fileNumber
+
+	# Don't hand out fileNumber while its file is still being written
+	def reserve(self, savedir, filebase, fileNumber):
+		key = (savedir, filebase)
+		self.reserved[key] = max(fileNumber + 1, self.reserved.get(key, 0))
+		self.expectChange(savedir)
+
+	# We are about to change savedir ourselves (a save, or another file we write there)
+	# Call published() or failed() once done
+	def expectChange(self, savedir):
+		self.pending[savedir] = self.pending.get(savedir, 0) + 1
+
+	# One of our files showed up in savedir
+	# Its number is already reserved, so once the last pending save is in,
+	# just take the new mtime instead of rescanning
+	def published(self, savedir):
+		if self.donePending(savedir):
+			return
+		try:
+			mtime = os.stat(savedir).st_mtime
+		except OSError:
+			return
+		for key, entry in self.entries.items():
+			if key[0] == savedir:
+				entry[0] = mtime
+
+	# One of our saves to savedir failed; it may have left a temp file behind,
+	# so rescan the directory next time instead of trusting the mtime
+	def failed(self, savedir):
+		if self.donePending(savedir):
+			return
+		for key in self.entries.keys():
+			if key[0] == savedir:
+				del self.entries[key]
+
+	# Count a pending save to savedir as done
+	# Returns True if others are still pending
+	def donePending(self, savedir):
+		n = self.pending.get(savedir, 0) - 1
+		if n > 0:
+			self.pending[savedir] = n
+			return True
+		self.pending.pop(savedir, None)
+		return False
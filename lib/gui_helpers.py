@@ -1,4 +1,5 @@
 import os
+import time
 import datetime
 
 import json
@@ -6,19 +7,16 @@ import json
 from PyQt4 import QtGui, QtCore, Qt
 from PyQt4.QtCore import pyqtSignal
 
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as NavigationToolbar
-from matplotlib.figure import Figure
-
-from matplotlib import pyplot as plt
-
 import numpy as np
 
 from copy import deepcopy
+from collections import OrderedDict
 
 from andor_helpers import *
 
-from krb_custom_colors import KRbCustomColors
+from file_index import FileNumberIndex
+from raster_view import RasterView
+from image_processing import ODEngine, DisplayPyramid, percentileLimits
 
 layout_params = {
 	'main': [1000, 975],
@@ -34,6 +32,9 @@ class ConfigForm(QtGui.QWidget):
 	# Initialize
 	def __init__(self, iw, Parent=None):
 		super(ConfigForm, self).__init__(Parent)
+		# Cached next file number for each save directory
+		self.fileNumbers = FileNumberIndex()
+
 		# Populate form widgets
 		self.populate()
 
@@ -43,8 +44,11 @@ class ConfigForm(QtGui.QWidget):
 		# Set default values for config form entries
 		self.setDefaultValues()
 
-	# These default parameters are set in the default_config dict in andor_helpers.py
-	def setDefaultValues(self, config=default_config):
+	# These default parameters are set in the default config, see getDefaultConfig in andor_helpers.py
+	def setDefaultValues(self, config=None):
+		if config is None:
+			config = getDefaultConfig()
+
 		self.kineticsFramesEdit.setValue(int(config['kinFrames']))
 		self.acqLengthEdit.setValue(int(config['acqLength']))
 
@@ -58,6 +62,16 @@ class ConfigForm(QtGui.QWidget):
 
 		self.binningControl.setChecked(config['binning'])
 
+		if config.has_key('stream'):
+			self.streamControl.setChecked(config['stream'])
+		else:
+			self.streamControl.setChecked(False)
+
+		if config.has_key('readout16'):
+			self.readout16Control.setChecked(config['readout16'])
+		else:
+			self.readout16Control.setChecked(False)
+
 		self.emGainEdit.setText(str(config['emGain']))
 		self.emEnableControl.setChecked(config['emEnable'])
 		self.emGainToggle()
@@ -70,10 +84,14 @@ class ConfigForm(QtGui.QWidget):
 		else:
 			self.rotateImageControl.setChecked(False)
 
-		if config.has_key('saveNpz'):
-			self.saveNpzControl.setChecked(config['saveNpz'])
+		# Older configs only have the saveNpz flag
+		if config.has_key('saveFormat'):
+			saveFormat = config['saveFormat']
+		elif config.has_key('saveNpz') and config['saveNpz']:
+			saveFormat = 'npz'
 		else:
-			self.saveNpzControl.setChecked(False)
+			saveFormat = 'csv'
+		self.saveFormatControl.setCurrentIndex(KRBCAM_SAVE_FORMATS.index(saveFormat))
 
 		try:
 			self.saveFolderEdit.setText(config['saveFolder'])
@@ -83,10 +101,10 @@ class ConfigForm(QtGui.QWidget):
 			self.fileBaseEdit.setText(KRBCAM_DEFAULT_FILENAME_BASE)
 		folder = str(self.saveFolderEdit.text()) + '\\'
 
-		# Default save path is built off of the default_config save path
+		# Default save path is built off of the default config save path
 		# plus the current date
 		now = datetime.datetime.now()
-		savedir = (default_config['savePath'] + KRBCAM_SAVE_PATH_SUFFIX + folder).format(now)
+		savedir = (getDefaultConfig()['savePath'] + KRBCAM_SAVE_PATH_SUFFIX + folder).format(now)
 		self.savePathEdit.setText(savedir)
 
 		# Check directory
@@ -115,7 +133,6 @@ class ConfigForm(QtGui.QWidget):
 	# Check save directory and file number
 	# using path defined in the save path field
 	def checkDir(self):
-		fileNumber = 0
 		savedir = str(self.savePathEdit.text())
 		folder = str(self.saveFolderEdit.text())
 		filebase = str(self.fileBaseEdit.text()) + '_'
@@ -127,33 +144,18 @@ class ConfigForm(QtGui.QWidget):
 		if savedir.find(suffix) == -1:
 			# Ensure that we are using the default save path before updating the path
 			# If we aren't, then all bets are off and we should just leave the path as is.
-			if savedir.find(KRBCAM_DEFAULT_SAVE_PATH) != -1:
+			if savedir.find(getDefaultSavePath()) != -1:
 				# Update the path in the GUI
-				savedir = KRBCAM_DEFAULT_SAVE_PATH + suffix
+				savedir = getDefaultSavePath() + suffix
 				self.savePathEdit.setText(savedir)
 
-		# Check if the directory exists
-		if os.path.isdir(savedir):
-			filelist = os.listdir(savedir)
-			for file in filelist:
-				# Extract the file number
-				# Files are saved as KRBCAM_FILENAME_BASE + filenumber + .csv/.npz
-				ind1 = len(filebase)
-				if not self.saveNpzControl.isChecked():
-					ind2 = file.find('.csv')
-				else:
-					ind2 = file.find('.npz')
-				
-				# Compare file number, if it's bigger than set fileNumber to 1 greater than that
-				try:
-					substr = file[ind1:ind2]
-					num = int(substr)
-					if num >= fileNumber:
-						fileNumber = num + 1
-				except:
-					pass
-		# If not, make the directory
-		else:
+		# Files are saved as KRBCAM_FILENAME_BASE + filenumber + .csv/.npz/.npy
+		ext = '.' + str(self.saveFormatControl.currentText())
+		fileNumber = self.fileNumbers.nextNumber(savedir, filebase, ext)
+
+		# If the directory doesn't exist, make it
+		if fileNumber is None:
+			fileNumber = 0
 			try:
 				os.makedirs(savedir)
 			except WindowsError: # If the drive doesn't exist
@@ -164,6 +166,19 @@ class ConfigForm(QtGui.QWidget):
 		# Update the file number field of the config form
 		self.fileNumberEdit.setText(str(fileNumber))
 
+	# Reserve a file number that is being written in the background
+	# so checkDir skips past it before the file shows up in the directory
+	def reserveFileNumber(self, savedir, filebase, fileNumber):
+		self.fileNumbers.reserve(savedir, filebase + '_', fileNumber)
+
+	# A file written in the background has been published to savedir
+	def filePublished(self, savedir):
+		self.fileNumbers.published(savedir)
+
+	# A file written in the background couldn't be saved to savedir
+	def fileFailed(self, savedir):
+		self.fileNumbers.failed(savedir)
+
 	# Setup Combo Boxes
 	# The items are dependent on the camera capabilities
 	def setupComboBoxes(self, config):
@@ -236,12 +251,14 @@ class ConfigForm(QtGui.QWidget):
 			form = {}
 			form['kinFrames'] = int(self.kineticsFramesEdit.value())
 			form['acqLength'] = int(self.acqLengthEdit.value())
+			form['stream'] = bool(self.streamControl.isChecked())
 			form['expTime'] = float(self.exposureEdit.text())
 			form['xOffset'] = int(self.xOffsetEdit.text())
 			form['yOffset'] = int(self.yOffsetEdit.text())
 			form['dx'] = int(self.dxEdit.text())
 			form['dy'] = int(self.dyEdit.text())
 			form['binning'] = bool(self.binningControl.isChecked())
+			form['readout16'] = bool(self.readout16Control.isChecked())
 			form['emEnable'] = bool(self.emEnableControl.isChecked())
 			form['emGain'] = int(self.emGainEdit.text())
 			form['fileNumber'] = int(self.fileNumberEdit.text())
@@ -254,7 +271,8 @@ class ConfigForm(QtGui.QWidget):
 			form['preAmpGain'] = self.preAmpGainControl.currentIndex()
 			form['saveFiles'] = bool(self.saveEnableControl.isChecked())
 			form['rotateImage'] = bool(self.rotateImageControl.isChecked())
-			form['saveNpz'] = bool(self.saveNpzControl.isChecked())
+			form['saveFormat'] = str(self.saveFormatControl.currentText())
+			form['saveNpz'] = form['saveFormat'] == 'npz'
 			return form
 		except:
 			self.throwErrorMessage("Invalid form data!", "Try again.")
@@ -322,6 +340,7 @@ class ConfigForm(QtGui.QWidget):
 
 		self.kineticsFramesEdit.setDisabled(acquiring)
 		self.acqLengthEdit.setDisabled(acquiring)
+		self.streamControl.setDisabled(acquiring)
 		self.exposureEdit.setDisabled(acquiring)
 		self.emEnableControl.setDisabled(acquiring)
 		self.emGainEdit.setDisabled(acquiring)
@@ -333,6 +352,7 @@ class ConfigForm(QtGui.QWidget):
 		self.dxEdit.setDisabled(acquiring)
 		self.dyEdit.setDisabled(acquiring)
 		self.binningControl.setDisabled(acquiring)
+		self.readout16Control.setDisabled(acquiring)
 		self.vssControl.setDisabled(acquiring)
 		self.savePathEdit.setDisabled(acquiring)
 		self.saveFolderEdit.setDisabled(acquiring)
@@ -340,7 +360,7 @@ class ConfigForm(QtGui.QWidget):
 		self.fileNumberEdit.setDisabled(acquiring)
 		self.saveEnableControl.setDisabled(acquiring)
 		self.rotateImageControl.setDisabled(acquiring)
-		self.saveNpzControl.setDisabled(acquiring)
+		self.saveFormatControl.setDisabled(acquiring)
 
 	def saveConfig(self):
 		fileName = QtGui.QFileDialog.getSaveFileName(self, "Save current configuration", PATH_TO_CONFIG, "JSON files (*.json)")
@@ -391,6 +411,10 @@ class ConfigForm(QtGui.QWidget):
 		self.acqLengthEdit = QtGui.QSpinBox(self)
 		self.acqLengthEdit.setRange(1,3)
 
+		self.streamStatic = QtGui.QLabel("Stream (run till abort)?", self)
+		self.streamControl = QtGui.QCheckBox(self)
+		self.streamControl.setToolTip("Single images only: arm the camera once and keep reading images as they arrive")
+
 		self.triggerStatic = QtGui.QLabel("Trigger Mode", self)
 		self.triggerEdit = QtGui.QLineEdit(self)
 
@@ -438,6 +462,9 @@ class ConfigForm(QtGui.QWidget):
 		self.binningStatic = QtGui.QLabel("Bin 2x2?", self)
 		self.binningControl = QtGui.QCheckBox(self)
 
+		self.readout16Static = QtGui.QLabel("16-bit readout?", self)
+		self.readout16Control = QtGui.QCheckBox(self)
+
 		if KRBCAM_ACQ_MODE == 4:
 			self.vssStatic = QtGui.QLabel("FKVS Speed", self)
 		elif KRBCAM_ACQ_MODE == 1:
@@ -463,8 +490,10 @@ class ConfigForm(QtGui.QWidget):
 		self.rotateImageStatic = QtGui.QLabel("Rotate image?", self)
 		self.rotateImageControl = QtGui.QCheckBox(self)
 
-		self.saveNpzStatic = QtGui.QLabel("Save .npz?", self)
-		self.saveNpzControl = QtGui.QCheckBox(self)
+		self.saveFormatStatic = QtGui.QLabel("Save format:", self)
+		self.saveFormatControl = QtGui.QComboBox(self)
+		for f in KRBCAM_SAVE_FORMATS:
+			self.saveFormatControl.addItem(f)
 		
 		self.layout = QtGui.QGridLayout()
 
@@ -487,6 +516,10 @@ class ConfigForm(QtGui.QWidget):
 		self.layout.addWidget(self.acqLengthEdit, row, 1)
 		row += 1
 
+		self.layout.addWidget(self.streamStatic, row, 0)
+		self.layout.addWidget(self.streamControl, row, 1)
+		row += 1
+
 		self.layout.addWidget(QtGui.QLabel(""), row, 0)
 		row += 1
 
@@ -541,6 +574,10 @@ class ConfigForm(QtGui.QWidget):
 		self.layout.addWidget(self.binningControl, row, 1)
 		row += 1
 
+		self.layout.addWidget(self.readout16Static, row, 0)
+		self.layout.addWidget(self.readout16Control, row, 1)
+		row += 1
+
 		self.layout.addWidget(self.vssStatic, row, 0)
 		self.layout.addWidget(self.vssControl, row, 1)
 		row += 1
@@ -572,8 +609,8 @@ class ConfigForm(QtGui.QWidget):
 		self.layout.addWidget(self.rotateImageControl, row, 1)
 
 		row += 1
-		self.layout.addWidget(self.saveNpzStatic, row, 0)
-		self.layout.addWidget(self.saveNpzControl, row, 1)
+		self.layout.addWidget(self.saveFormatStatic, row, 0)
+		self.layout.addWidget(self.saveFormatControl, row, 1)
 
 		self.setLayout(self.layout)
 
@@ -597,6 +634,8 @@ class AcquireAbortStatus(QtGui.QWidget):
 		self.acquireControl.setDisabled(False)
 		self.abortControl.setDisabled(True)
 		self.statusEdit.setText("Python GUI initialized.\n")
+		self.setWriterStatus(0, 0)
+		self.metricsStatic.hide()
 
 	# Enable abort, disable acquire
 	def acquire(self):
@@ -608,6 +647,18 @@ class AcquireAbortStatus(QtGui.QWidget):
 		self.abortControl.setDisabled(True)
 		self.acquireControl.setDisabled(False)
 
+	# Show the background writer queue depth and the time the last write took
+	def setWriterStatus(self, pending, latency):
+		self.writerStatic.setText("Save queue: {} pending, last write {:.0f} ms".format(pending, 1000*latency))
+
+	# Show the per-shot stage timings, rows of (stage, last, mean, p95) in ms
+	def setMetricsSummary(self, rows):
+		lines = ["{:<10}{:>9}{:>9}{:>9}".format("Stage (ms)", "last", "mean", "p95")]
+		for (stage, last, mean, p95) in rows:
+			lines.append("{:<10}{:9.1f}{:9.1f}{:9.1f}".format(stage, last, mean, p95))
+		self.metricsStatic.setText("\n".join(lines))
+		self.metricsStatic.show()
+
 	# Populate the GUI
 	def populate(self):
 		self.layout = QtGui.QVBoxLayout()
@@ -619,11 +670,16 @@ class AcquireAbortStatus(QtGui.QWidget):
 		self.statusEdit = QtGui.QTextEdit()
 		self.statusEdit.setReadOnly(True)
 		self.statusEdit.setStyleSheet("color: rgb(0,0,0);")
+		self.writerStatic = QtGui.QLabel()
+		self.metricsStatic = QtGui.QLabel()
+		self.metricsStatic.setFont(QtGui.QFont("Courier"))
 
 		self.layout.addWidget(self.acquireControl)
 		self.layout.addWidget(self.abortControl)
 		self.layout.addWidget(self.statusStatic)
 		self.layout.addWidget(self.statusEdit)
+		self.layout.addWidget(self.writerStatic)
+		self.layout.addWidget(self.metricsStatic)
 
 		self.setLayout(self.layout)
 
@@ -714,13 +770,30 @@ class CoolerControl(QtGui.QWidget):
 
 # Window for displaying images after they are acquired
 class ImageWindow(QtGui.QWidget):
-	data = []
+	# The shot being shown, indexed by (acquisition loop frame, FK frame, row, column)
+	data = None
 
 	def __init__(self, Parent=None):
 		super(ImageWindow, self).__init__(Parent)
 		self.setFixedSize(layout_params['image'][0],layout_params['image'][1])
 		self.populate()
 
+		# Persistent plot artists, built on the first plot
+		# and rebuilt when the shape or orientation of the image changes
+		self.im = None
+		self.plotLayout = None
+		self.pyramid = None
+
+		# Redraw scheduling, see displayData
+		self.redrawPending = False
+		self.lastRedraw = 0
+		self.live = False
+		# Redraws asked for and redraws actually done, since the counts were last reset
+		self.redrawRequests = 0
+		self.redrawCount = 0
+		# Called with the start and end time of the next redraw, see whenDrawn
+		self.drawCallbacks = []
+
 		# Default od and count limits
 		self.odLimits = [[0,3]]*KRBCAM_N_PLOT_SETTINGS
 		self.countLimits = [[500,2000]]*KRBCAM_N_PLOT_SETTINGS
@@ -731,13 +804,19 @@ class ImageWindow(QtGui.QWidget):
 
 		self.odFrames = [0]*KRBCAM_N_PLOT_SETTINGS
 
+		# OD images that have already been calculated, most recently used last
+		# Keyed by (data generation, setting, (shadow, light, dark) frames)
+		self.odCache = OrderedDict()
+		self.odEngine = ODEngine()
+
+		# Autoscaled display limits, keyed like the OD cache plus the frame shown
+		self.autoscaleCache = {}
+		# Incremented each time new data comes in
+		self.dataGeneration = 0
+
 		# Frame select state
 		self.frameSelectState = [[(None,None), (None,None), (None,None)]]*KRBCAM_N_PLOT_SETTINGS
 
-		# Colormaps
-		self.colors = KRbCustomColors()
-		self.cmaps = [self.colors.whiteJet, self.colors.whiteMagma, self.colors.whitePlasma, plt.cm.jet]
-
 		# Set default values
 		self.setDefaultValues()
 
@@ -777,12 +856,16 @@ class ImageWindow(QtGui.QWidget):
 
 			self.resetComboBoxes(numKin, acqLength)
 
+	# The (acquisition loop frame, FK frame) selected in each combo box
+	# The items are listed in order, so the index is all that's needed
 	def getComboBoxState(self):
 		arr = []
 
 		for widget in self.frameSelectArray:
-			text = widget.currentText()
-			arr.append( (int(text.split(',')[0]), int(text.split(',')[1])) )
+			index = widget.currentIndex()
+			if index < 0:
+				raise ValueError("Frame selection is not set up.")
+			arr.append(divmod(index, self.gFKSeriesLength))
 
 		return arr
 
@@ -807,9 +890,18 @@ class ImageWindow(QtGui.QWidget):
 	# Populate GUI
 	# self.displayData is a listener for any state change of the buttons
 	def populate(self):
-		self.figure = Figure()
-		self.canvas = FigureCanvas(self.figure)
-		self.toolbar = NavigationToolbar(self.canvas, self)
+		# The matplotlib figure, canvas and toolbar are made when the first image is shown, see setupPlotting
+		self.figure = None
+		self.canvas = None
+		self.toolbar = None
+		self.placeholder = QtGui.QLabel("No image yet", self)
+		self.placeholder.setAlignment(QtCore.Qt.AlignCenter)
+
+		# Fast live view, shown instead of the matplotlib canvas when enabled
+		self.raster = RasterView(self)
+		self.plotStack = QtGui.QStackedWidget(self)
+		self.plotStack.addWidget(self.placeholder)
+		self.plotStack.addWidget(self.raster)
 
 		self.settingLabel = QtGui.QLabel("Setting")
 		self.settingSelect = QtGui.QComboBox(self)
@@ -862,12 +954,26 @@ class ImageWindow(QtGui.QWidget):
 		self.autoscaleButton = QtGui.QPushButton("Autoscale", self)
 		self.autoscaleButton.clicked.connect(self.autoscale)
 
+		self.autoscaleLabel = QtGui.QLabel("Autoscale each shot", self)
+		self.autoscaleControl = QtGui.QCheckBox(self)
+
+		self.decimateLabel = QtGui.QLabel("Downsample", self)
+		self.decimateSelect = QtGui.QComboBox(self)
+		self.decimateSelect.addItem("Mean")
+		self.decimateSelect.addItem("Max")
+		self.decimateSelect.setToolTip("How large images are shrunk to fit the screen")
+		self.decimateSelect.currentIndexChanged.connect(self.displayData)
+
+		self.rasterLabel = QtGui.QLabel("Fast view", self)
+		self.rasterControl = QtGui.QCheckBox(self)
+		self.rasterControl.setToolTip("Draw images directly, without matplotlib (no colorbar or toolbar)")
+		self.rasterControl.stateChanged.connect(self.rasterToggle)
+
 		self.spacer = QtGui.QSpacerItem(1,1)
 
 		self.layout = QtGui.QGridLayout()
 
-		self.layout.addWidget(self.toolbar,0,0,1,6)
-		self.layout.addWidget(self.canvas,1,0,6,6)
+		self.layout.addWidget(self.plotStack,1,0,6,6)
 		
 		row = 8
 		self.layout.addWidget(self.settingLabel, row, 0)
@@ -904,6 +1010,18 @@ class ImageWindow(QtGui.QWidget):
 		row += 1
 
 		self.layout.addWidget(self.autoscaleButton,row,4,1,2)
+		row += 1
+
+		self.layout.addWidget(self.autoscaleLabel,row,4)
+		self.layout.addWidget(self.autoscaleControl,row,5)
+		row += 1
+
+		self.layout.addWidget(self.decimateLabel,row,4)
+		self.layout.addWidget(self.decimateSelect,row,5)
+		row += 1
+
+		self.layout.addWidget(self.rasterLabel,row,4)
+		self.layout.addWidget(self.rasterControl,row,5)
 
 		# Try to make the layout look nice
 		for i in range(4):
@@ -912,23 +1030,78 @@ class ImageWindow(QtGui.QWidget):
 		self.setLayout(self.layout)
 
 	def autoscale(self):
-		(setting, frame) = self.getConfig()
-
-		if frame == 0:
-			low = np.percentile(self.odFrames[setting], KRBCAM_AUTOSCALE_PERCENTILES[0])
-			high = np.percentile(self.odFrames[setting], KRBCAM_AUTOSCALE_PERCENTILES[1])
-		else:
-			(i0, i1) = self.getComboBoxState()[frame-1]
-			low = np.percentile(self.data[i0][i1], KRBCAM_AUTOSCALE_PERCENTILES[0])
-			high = np.percentile(self.data[i0][i1], KRBCAM_AUTOSCALE_PERCENTILES[1])
+		try:
+			(low, high) = self.autoscaleLimits()
+		# Combo boxes not set up yet, or no data
+		except Exception as e:
+			print(e)
+			return
 
 		self.minEdit.setText(str(low))
 		self.maxEdit.setText(str(high))
 		self.validateLimits()
 
+	# Display limits for the image that is currently selected
+	# The limits are cached until new data comes in
+	def autoscaleLimits(self):
+		(setting, frame) = self.getConfig()
+		config = self.getComboBoxState()
+
+		key = (self.dataGeneration, setting, frame, tuple(config))
+		if not self.autoscaleCache.has_key(key):
+			if frame == 0:
+				image = self.getOD(setting, config)
+			else:
+				(i0, i1) = config[frame-1]
+				image = self.data[i0, i1]
+			self.autoscaleCache[key] = percentileLimits(image)
+
+		return self.autoscaleCache[key]
+
 	# Display the data!
+	# Changing the combo boxes fires a burst of signals, so requests are coalesced:
+	# the redraw happens once, on the next turn of the event loop,
+	# and at most KRBCAM_LIVE_FPS times per second while acquiring
 	def displayData(self):
-		if self.data:
+		self.redrawRequests += 1
+		if self.redrawPending:
+			return
+		self.redrawPending = True
+
+		delay = 0
+		if self.live:
+			delay = max(0, self.lastRedraw + 1.0/KRBCAM_LIVE_FPS - time.time())
+		QtCore.QTimer.singleShot(int(1000*delay), self.redraw)
+
+	def redraw(self):
+		self.redrawPending = False
+		self.lastRedraw = time.time()
+		self.redrawCount += 1
+		self.drawData()
+
+		if self.drawCallbacks:
+			(callbacks, self.drawCallbacks) = (self.drawCallbacks, [])
+			end = time.time()
+			for callback in callbacks:
+				callback(self.lastRedraw, end)
+
+	# Call callback(start, end) once the next redraw is done
+	def whenDrawn(self, callback):
+		self.drawCallbacks.append(callback)
+
+	# Limit the redraw rate while acquiring
+	def setLive(self, live):
+		self.live = live
+
+	# Returns (redraws requested, redraws done) and resets the counts
+	def getRedrawStats(self):
+		stats = (self.redrawRequests, self.redrawCount)
+		self.redrawRequests = 0
+		self.redrawCount = 0
+		return stats
+
+	def drawData(self):
+		if self.data is not None:
 			try:
 				# Take the button states and determine what image the user wants to see
 				(setting, frame) = self.getConfig()
@@ -952,23 +1125,50 @@ class ImageWindow(QtGui.QWidget):
 				self.maxEdit.setText(str(lims[1]))
 
 				if frame == 0:
-					self.odFrames[setting] = self.calcOD(self.getComboBoxState())
+					self.odFrames[setting] = self.getOD(setting, self.getComboBoxState())
 					self.plot(self.odFrames[setting], lims[0], lims[1])
 				else:
 					(i0, i1) = self.getComboBoxState()[frame-1]
-					self.plot(self.data[i0][i1], lims[0], lims[1])
+					self.plot(self.data[i0, i1], lims[0], lims[1])
 				
 			# AttributeError will occur if no data collected, since
 			# then self.data is undefined
 			except Exception as e:
 				print(e)
 
-	def setData(self, data, kinFrames, acqLength):
+	# data is the run buffer from the main GUI, in display orientation,
+	# indexed by (acquisition loop frame, FK frame, row, column)
+	# ods and limits are OD images and their autoscale limits that were already
+	# calculated, keyed by (setting, (shadow, light, dark)) (see ShotProcessor)
+	def setData(self, data, kinFrames, acqLength, ods=None, limits=None):
 		self.controlComboBoxes(kinFrames, acqLength)
-		self.data = self.processData(data)
+		self.data = data
+
+		# ODs of the old data can't be asked for any more
+		self.dataGeneration += 1
+		self.odCache.clear()
+		self.autoscaleCache.clear()
+
+		if ods:
+			for ((setting, config), od) in ods.items():
+				self.odCache[(self.dataGeneration, setting, config)] = od
+		if limits:
+			for ((setting, config), lims) in limits.items():
+				self.autoscaleCache[(self.dataGeneration, setting, 0, config)] = lims
+
+		# Rescale for the new shot before it is displayed
+		if self.autoscaleControl.isChecked():
+			try:
+				(low, high) = self.autoscaleLimits()
+				self.minEdit.setText(str(low))
+				self.maxEdit.setText(str(high))
+				self.validateLimits(False)
+			except Exception as e:
+				print(e)
 
 	# Validate the entered values in the min and max boxes
-	def validateLimits(self):
+	# The image is redrawn with the new limits unless display is False
+	def validateLimits(self, display=True):
 		# Try to cast to int
 		try:
 			max_entry = float(self.maxEdit.text())
@@ -998,7 +1198,8 @@ class ImageWindow(QtGui.QWidget):
 				self.countLimits[setting] = [min_entry, max_entry]
 				
 			# Update the image shown on the screen
-			self.displayData()
+			if display:
+				self.displayData()
 		except:
 			msgBox = QtGui.QMessageBox()
 			msgBox.setText("Invalid entry for image display limits.")
@@ -1014,81 +1215,162 @@ class ImageWindow(QtGui.QWidget):
 
 		if self.frameSelectState[setting] != config:
 			self.frameSelectState[setting] = config
-			self.odFrames[setting] = self.calcOD(config)
+			self.odFrames[setting] = self.getOD(setting, config)
 
 		frame = self.frameSelect.currentIndex()	
 		return (setting, frame)
 
+	# The (shadow, light, dark) frames selected in each setting,
+	# as a list of (setting, selection)
+	def getODSelections(self):
+		selections = []
+		for (setting, config) in enumerate(self.frameSelectState):
+			# States loaded from a config file have lists instead of tuples
+			if config[0][0] is not None:
+				selections.append((setting, tuple(tuple(f) for f in config)))
+		return selections
+
+	# Get the OD image for the frames in config, calculating it only if it isn't cached
+	def getOD(self, setting, config):
+		key = (self.dataGeneration, setting, tuple(config))
+		od = self.odCache.pop(key, None)
+		if od is None:
+			od = self.calcOD(config)
+
+		self.odCache[key] = od
+		while len(self.odCache) > KRBCAM_OD_CACHE_SIZE:
+			self.odCache.popitem(last=False)
+
+		return od
+
 	def calcOD(self, config):
 		(s0, s1) = config[0]
 		(l0, l1) = config[1]
 		(d0, d1) = config[2]
 
-		shadow = self.data[s0][s1]
-		light = self.data[l0][l1]
-		dark = self.data[d0][d1]
-
-		with np.errstate(divide='ignore', invalid='ignore'):
-			od = np.log((light-dark).astype(float)/(shadow-dark).astype(float))
-			od += (light - shadow)/float(KRBCAM_C_SAT)
-			od[np.isnan(od)] = 0
-			od[np.isinf(od)] = 0
-			od[od > KRBCAM_OD_MAX] = KRBCAM_OD_MAX
+		return self.odEngine.calcOD(self.data[s0, s1], self.data[l0, l1], self.data[d0, d1])
 
-		return od
-
-	# Separate images, get OD image
-	def processData(self, data):
-		out = []
+	# Switch between the matplotlib canvas and the fast live view
+	def rasterToggle(self):
+		if self.canvas is not None:
+			self.showPlotWidget()
+		self.displayData()
 
-		# Data comes in as an array sorted by FK index
-		# with acquisition loop frames concatenated
-		# 
-		# We want to change the indices for convenience
-		for i in range(self.gAcqLoopLength):
-			arr = []
+	def showPlotWidget(self):
+		fast = self.rasterControl.isChecked()
+		self.plotStack.setCurrentWidget(self.raster if fast else self.canvas)
+		self.toolbar.setDisabled(fast)
 
-			# Loop through kinetics frames
-			# and pull out the i-th acquisition loop frame
-			for j in range(self.gFKSeriesLength):
-				x = data[j]
-				(length, width) = np.shape(x)
+	# Build the matplotlib canvas and toolbar, and the colormaps
+	# Importing matplotlib and making the colormaps is slow,
+	# so it's left until the first image is shown instead of slowing down startup
+	def setupPlotting(self):
+		if self.canvas is not None:
+			return
 
-				length /= self.gAcqLoopLength
+		from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
+		from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as NavigationToolbar
+		from matplotlib.figure import Figure
+		from matplotlib import cm
+		from krb_custom_colors import KRbCustomColors
 
-				arr.append(x[i*length:(i+1)*length])
+		self.figure = Figure()
+		self.canvas = FigureCanvas(self.figure)
+		self.toolbar = NavigationToolbar(self.canvas, self)
+		self.plotStack.addWidget(self.canvas)
+		self.layout.addWidget(self.toolbar,0,0,1,6)
 
-			out.append(arr)
+		# Colormaps
+		self.colors = KRbCustomColors()
+		self.cmaps = [self.colors.whiteJet, self.colors.whiteMagma, self.colors.whitePlasma, cm.jet]
+		self.raster.setColormaps(self.cmaps)
 
-		# Now out should be a 2d array of data
-		# First index is acquisition loop frame
-		# Second index is FK frame
-		return out
+		self.showPlotWidget()
 
 	# Plot the data
+	# The axes, image and colorbar are only built when the image shape or the
+	# colorbar orientation changes. Otherwise the existing image is updated,
+	# and the colorbar follows it through the image's change callbacks.
+	#
+	# Only the part of the data in view is drawn, downsampled to about the
+	# size of the axes on screen (see DisplayPyramid)
 	def plot(self, data, vmin, vmax):
+		self.setupPlotting()
+		color_index = self.colorSelect.currentIndex()
+
+		# Fast live view
+		if self.rasterControl.isChecked():
+			self.raster.setImage(data, vmin, vmax, color_index)
+			return
+
+		cmap = self.cmaps[color_index]
+
+		# Keep the data around for the toolbar readout
+		self.plotData = data
+
+		# Downsampled copies of the data, reused while the same image is shown
+		mode = str(self.decimateSelect.currentText()).lower()
+		if self.pyramid is None or not self.pyramid.isFor(data, mode):
+			self.pyramid = DisplayPyramid(data, mode)
+
+		layout = (np.shape(data), self.colorbarOrientation)
+		if self.im is None or self.plotLayout != layout:
+			self.setupPlot(vmin, vmax, cmap)
+			self.plotLayout = layout
+		else:
+			if self.im.get_cmap() is not cmap:
+				self.im.set_cmap(cmap)
+			if self.im.get_clim() != (vmin, vmax):
+				self.im.set_clim(vmin, vmax)
+
+		self.updateView()
+
+		# Update the plot
+		self.canvas.draw_idle()
+
+	# Build the axes, image and colorbar from scratch
+	def setupPlot(self, vmin, vmax, cmap):
 		# Clear plot
 		self.figure.clear()
 
 		# Plot the data
-		ax = self.figure.add_subplot(111)
-		color_index = self.colorSelect.currentIndex()
-		im = ax.imshow(data, vmin=vmin, vmax=vmax, cmap=self.cmaps[color_index])
+		# The axes limits are in full resolution pixels, whatever is drawn
+		(h, w) = np.shape(self.plotData)
+		self.ax = self.figure.add_subplot(111)
+		self.im = self.ax.imshow(np.zeros((1,1)), vmin=vmin, vmax=vmax, cmap=cmap)
+		self.ax.set_autoscale_on(False)
+		self.ax.set_xlim(-0.5, w - 0.5)
+		self.ax.set_ylim(h - 0.5, -0.5)
 
 		# Add a horizontal colorbar
-		self.figure.colorbar(im, orientation=self.colorbarOrientation)
+		self.cbar = self.figure.colorbar(self.im, orientation=self.colorbarOrientation)
 
 		# Need to do the following to get the z data to show up in the toolbar
-		numrows, numcols = np.shape(data)
-		def format_coord(x, y):
-		    col = int(x + 0.5)
-		    row = int(y + 0.5)
-		    if col >= 0 and col < numcols and row >= 0 and row < numrows:
-		        z = data[row, col]
-		        return '({:},{:}), z={:.2f}'.format(int(x),int(y),z)
-		    else:
-		        return 'x=%1.4f, y=%1.4f' % (x, y)
-		ax.format_coord = format_coord
-
-		# Update the plot
-		self.canvas.draw()
\ No newline at end of file
+		self.ax.format_coord = self.formatCoord
+
+		# Redo the image when the toolbar zooms or pans
+		self.ax.callbacks.connect('xlim_changed', self.viewChanged)
+		self.ax.callbacks.connect('ylim_changed', self.viewChanged)
+
+	def viewChanged(self, ax):
+		self.updateView()
+
+	# Draw the region of the data inside the axes limits
+	def updateView(self):
+		(x0, x1) = sorted(self.ax.get_xlim())
+		(y0, y1) = sorted(self.ax.get_ylim())
+		bbox = self.ax.get_window_extent()
+
+		(tile, extent) = self.pyramid.view(x0, x1, y0, y1, bbox.width, bbox.height)
+		self.im.set_data(tile)
+		self.im.set_extent(extent)
+
+	def formatCoord(self, x, y):
+		numrows, numcols = np.shape(self.plotData)
+		col = int(x + 0.5)
+		row = int(y + 0.5)
+		if col >= 0 and col < numcols and row >= 0 and row < numrows:
+			z = self.plotData[row, col]
+			return '({:},{:}), z={:.2f}'.format(int(x),int(y),z)
+		else:
+			return 'x=%1.4f, y=%1.4f' % (x, y)
@@ -0,0 +1,245 @@
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from andor_helpers import *
+
+# Optical density calculation
+#
+# Works in float32 with in-place ufuncs, so apart from the output the only
+# full-size arrays are scratch buffers that are kept between calls.
+# Large frames are split into blocks of rows that run in a thread pool;
+# numpy releases the GIL inside the ufuncs, so the blocks run in parallel.
+#
+# The result is the same as
+#	od = log((light-dark)/(shadow-dark)) + (light-shadow)/KRBCAM_C_SAT
+# with nan and inf set to 0 and values above KRBCAM_OD_MAX set to KRBCAM_OD_MAX
+class ODEngine(object):
+	def __init__(self, nThreads=KRBCAM_OD_THREADS, blockRows=KRBCAM_OD_BLOCK_ROWS):
+		self.blockRows = blockRows
+
+		# No point in more threads than cores
+		nThreads = min(nThreads, cpu_count())
+		self.pool = ThreadPool(nThreads) if nThreads > 1 else None
+		self.shape = None
+
+	# Scratch buffers for frames of a given shape
+	def allocate(self, shape):
+		self.scratch = np.empty(shape, dtype=np.float32)
+		self.mask = np.empty(shape, dtype=bool)
+		self.shape = shape
+
+	# shadow, light and dark are frames of the same shape, of any numeric type
+	# The OD is written into out if given, otherwise into a new float32 array
+	def calcOD(self, shadow, light, dark, out=None):
+		shape = np.shape(shadow)
+		if self.shape != shape:
+			self.allocate(shape)
+		if out is None:
+			out = np.empty(shape, dtype=np.float32)
+
+		rows = shape[0]
+		blocks = [(r, min(r + self.blockRows, rows)) for r in range(0, rows, self.blockRows)]
+
+		if self.pool is not None and len(blocks) > 1:
+			self.pool.map(lambda b: self.calcBlock(shadow, light, dark, out, b[0], b[1]), blocks)
+		else:
+			for b in blocks:
+				self.calcBlock(shadow, light, dark, out, b[0], b[1])
+
+		return out
+
+	# Calculate the OD for rows r0 to r1
+	def calcBlock(self, shadow, light, dark, out, r0, r1):
+		s = shadow[r0:r1]
+		l = light[r0:r1]
+		d = dark[r0:r1]
+		od = out[r0:r1]
+		tmp = self.scratch[r0:r1]
+		mask = self.mask[r0:r1]
+
+		# The error state is per thread, so it's set here and not in calcOD
+		with np.errstate(divide='ignore', invalid='ignore'):
+			# Subtract in float32, so that 16-bit (unsigned) frames can't wrap around
+			np.subtract(l, d, out=od, dtype=np.float32)
+			np.subtract(s, d, out=tmp, dtype=np.float32)
+			np.divide(od, tmp, out=od)
+			np.log(od, out=od)
+
+			# Correction for saturation
+			np.subtract(l, s, out=tmp, dtype=np.float32)
+			np.divide(tmp, KRBCAM_C_SAT, out=tmp)
+			np.add(od, tmp, out=od)
+
+			# nan and inf go to 0
+			np.isfinite(od, out=mask)
+			np.logical_not(mask, out=mask)
+			np.copyto(od, 0, where=mask)
+
+			np.minimum(od, KRBCAM_OD_MAX, out=od)
+
+# Rotate frames by 90 degrees, from the camera orientation to the displayed one
+# The last two axes of data are rows and columns; returns a view, nothing is copied
+def rotateFrames(data):
+	return np.flip(np.swapaxes(data, -2, -1), axis=-1)
+
+# Percentiles of a frame, for autoscaling the display limits
+# Returns the same values as np.percentile (with linear interpolation),
+# but all percentiles come out of a single pass over the frame:
+# a histogram for integer count frames, one np.partition for anything else
+def percentileLimits(frame, percentiles=KRBCAM_AUTOSCALE_PERCENTILES):
+	flat = np.ravel(frame)
+	n = flat.size
+
+	# Ranks in the sorted frame, which may fall between two pixels
+	ranks = [p/100.0*(n - 1) for p in percentiles]
+	kth = sorted(set([int(np.floor(k)) for k in ranks] + [int(np.ceil(k)) for k in ranks]))
+
+	values = {}
+	if np.issubdtype(flat.dtype, np.integer):
+		low = int(flat.min())
+		high = int(flat.max())
+	if np.issubdtype(flat.dtype, np.integer) and high - low < KRBCAM_AUTOSCALE_MAX_BINS:
+		# Cumulative histogram: the k-th smallest value is the first bin
+		# where more than k pixels are at or below it
+		cdf = np.cumsum(np.bincount(flat - low))
+		for k in kth:
+			values[k] = low + np.searchsorted(cdf, k, side='right')
+	else:
+		part = np.partition(flat, kth)
+		for k in kth:
+			values[k] = part[k]
+
+	out = []
+	for k in ranks:
+		(f, c) = (int(np.floor(k)), int(np.ceil(k)))
+		out.append(values[f] + (values[c] - values[f])*(k - f))
+	return out
+
+# Downsample a frame by factor in both directions
+# Each block of factor x factor pixels is replaced by its mean or its max (mode 'mean' or 'max')
+# The last block in each direction is smaller if the frame isn't a multiple of factor
+def decimate(frame, factor, mode='mean'):
+	(h, w) = np.shape(frame)
+
+	# Go through the pixels at each offset within the blocks;
+	# these are strided views, so each pass is one vectorized operation
+	if mode == 'max':
+		out = np.array(frame[::factor, ::factor])
+	else:
+		out = np.zeros((-(-h//factor), -(-w//factor)), dtype=np.float32)
+	for i in range(factor):
+		for j in range(factor):
+			block = frame[i::factor, j::factor]
+			target = out[:block.shape[0], :block.shape[1]]
+			if mode == 'max':
+				np.maximum(target, block, out=target)
+			else:
+				np.add(target, block, out=target, casting='unsafe')
+
+	if mode != 'max':
+		rows = np.arange(0, h, factor)
+		cols = np.arange(0, w, factor)
+		out /= np.outer(np.diff(np.append(rows, h)), np.diff(np.append(cols, w)))
+	return out
+
+# Downsampled copies of a frame for display
+#
+# Levels are downsampled by powers of 2 and made when first needed.
+# view() picks the coarsest level that still has at least one pixel per screen pixel
+# and cuts out the visible region, so the amount drawn depends on the
+# screen size and not on the size of the frame.
+class DisplayPyramid(object):
+	def __init__(self, frame, mode='mean'):
+		self.frame = frame
+		self.mode = mode
+		self.shape = np.shape(frame)
+		self.levels = {1: frame}
+
+	# Frames are usually fresh views of the same shot, so compare the memory they point to
+	# (the pyramid keeps its frame alive, so the memory can't have been reused)
+	def isFor(self, frame, mode):
+		a = self.frame.__array_interface__
+		b = frame.__array_interface__
+		return mode == self.mode and (a['data'], a['shape'], a['strides'], a['typestr']) == (b['data'], b['shape'], b['strides'], b['typestr'])
+
+	def level(self, factor):
+		if not self.levels.has_key(factor):
+			self.levels[factor] = decimate(self.frame, factor, self.mode)
+		return self.levels[factor]
+
+	# The region from x0 to x1 and y0 to y1, in full resolution pixel coordinates,
+	# shown on width x height screen pixels
+	# Returns the image to draw and its extent for imshow, in full resolution pixel coordinates
+	def view(self, x0, x1, y0, y1, width, height):
+		(h, w) = self.shape
+
+		# Full resolution pixels that are (partly) visible
+		c0 = max(int(np.floor(x0 + 0.5)), 0)
+		c1 = min(int(np.ceil(x1 + 0.5)), w)
+		r0 = max(int(np.floor(y0 + 0.5)), 0)
+		r1 = min(int(np.ceil(y1 + 0.5)), h)
+		if c1 <= c0 or r1 <= r0:
+			(c0, c1, r0, r1) = (0, w, 0, h)
+
+		needed = max((c1 - c0)/float(max(width, 1)), (r1 - r0)/float(max(height, 1)))
+		factor = 1
+		while 2*factor <= needed:
+			factor *= 2
+
+		# Same region in the downsampled level
+		(c0, c1) = (c0//factor, -(-c1//factor))
+		(r0, r1) = (r0//factor, -(-r1//factor))
+		tile = self.level(factor)[r0:r1, c0:c1]
+
+		# Blocks are drawn factor pixels wide,
+		# a smaller last block sticks out past the edge of the frame
+		extent = (c0*factor - 0.5, c1*factor - 0.5, r1*factor - 0.5, r0*factor - 0.5)
+		return (tile, extent)
+
+# The original float64 calculation, for comparison
+def calcODReference(shadow, light, dark):
+	shadow = shadow.astype(float)
+	light = light.astype(float)
+	dark = dark.astype(float)
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		od = np.log((light-dark)/(shadow-dark))
+		od += (light - shadow)/float(KRBCAM_C_SAT)
+		od[np.isnan(od)] = 0
+		od[np.isinf(od)] = 0
+		od[od > KRBCAM_OD_MAX] = KRBCAM_OD_MAX
+
+	return od
+
+# Benchmark on 1024x1024 frames that look like an absorption image
+# Run from the main directory: python lib/image_processing.py
+if __name__ == "__main__":
+	size = 1024
+	repeats = 20
+
+	(y, x) = np.mgrid[0:size, 0:size]
+	cloud = np.exp(-((x - size/2.0)**2 + (y - size/2.0)**2)/(2*(size/8.0)**2))
+	dark = np.random.poisson(100, (size, size)).astype(np.int32)
+	light = dark + np.random.poisson(1500, (size, size)).astype(np.int32)
+	shadow = dark + np.random.poisson(1500*np.exp(-2*cloud)).astype(np.int32)
+
+	def bench(f):
+		f()
+		start = time.time()
+		for i in range(repeats):
+			f()
+		return 1000*(time.time() - start)/repeats
+
+	ref = calcODReference(shadow, light, dark)
+	t_ref = bench(lambda: calcODReference(shadow, light, dark))
+	print("float64 reference: {:.1f} ms".format(t_ref))
+
+	for n in [1, KRBCAM_OD_THREADS]:
+		engine = ODEngine(nThreads=n)
+		out = np.empty((size, size), dtype=np.float32)
+		od = engine.calcOD(shadow, light, dark, out)
+		t = bench(lambda: engine.calcOD(shadow, light, dark, out))
+		print("ODEngine, {} thread(s): {:.1f} ms ({:.1f}x), max difference {:.2g}".format(n, t, t_ref/t, np.abs(od - ref).max()))
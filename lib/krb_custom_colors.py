@@ -1,4 +1,3 @@
-from matplotlib import pyplot as plt
 from matplotlib import cm
 import numpy as np
 from matplotlib.colors import ListedColormap, LinearSegmentedColormap
@@ -64,6 +63,8 @@ def plot_examples(cms):
     """
     helper function to plot two colormaps
     """
+    from matplotlib import pyplot as plt
+
     np.random.seed(19680801)
     poo = np.random.randn(30, 30)
 
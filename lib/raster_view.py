@@ -0,0 +1,79 @@
+from PyQt4 import QtGui, QtCore
+
+import numpy as np
+
+from andor_helpers import *
+
+# Build a QImage color table from a matplotlib colormap
+# The white* colormaps fade in with alpha, so the colors are composited
+# over a white background, the same as on the matplotlib figure
+def makeColorTable(cmap, n=KRBCAM_LUT_SIZE):
+	rgba = cmap(np.linspace(0, 1, n))
+	rgb = rgba[:,:3]*rgba[:,3:] + (1 - rgba[:,3:])
+	rgb = np.round(255*rgb).astype(np.uint32)
+	argb = 0xff000000 | (rgb[:,0] << 16) | (rgb[:,1] << 8) | rgb[:,2]
+	return [int(c) for c in argb]
+
+# Scale data between vmin and vmax onto color table indices
+# out is a uint8 array with the same shape as data,
+# scratch is a float32 array with the same shape as data
+def scaleToIndices(data, vmin, vmax, out, scratch):
+	np.subtract(data, vmin, out=scratch, casting='unsafe')
+	scratch *= (KRBCAM_LUT_SIZE - 1)/float(vmax - vmin)
+	np.clip(scratch, 0, KRBCAM_LUT_SIZE - 1, out=scratch)
+	out[...] = scratch
+
+# Lightweight live view
+#
+# Frames are turned into 8-bit color table indices and painted as an
+# indexed QImage, without going through matplotlib.
+# The image is scaled to fit the widget, keeping the aspect ratio.
+class RasterView(QtGui.QWidget):
+	def __init__(self, Parent=None):
+		super(RasterView, self).__init__(Parent)
+		self.colorTables = []
+		self.image = None
+		self.shape = None
+
+		self.setAutoFillBackground(True)
+		palette = self.palette()
+		palette.setColor(self.backgroundRole(), QtCore.Qt.white)
+		self.setPalette(palette)
+
+	# Color tables are built once, one for each colormap
+	def setColormaps(self, cmaps):
+		self.colorTables = [makeColorTable(c) for c in cmaps]
+
+	# (Re)allocate the buffers for a new image shape
+	# QImage wants each row 32-bit aligned, so the rows are padded
+	def allocate(self, shape):
+		(h, w) = shape
+		stride = (w + 3) & ~3
+		self.buffer = np.zeros((h, stride), dtype=np.uint8)
+		self.indices = self.buffer[:, :w]
+		self.scratch = np.empty(shape, dtype=np.float32)
+		self.image = QtGui.QImage(self.buffer.data, w, h, stride, QtGui.QImage.Format_Indexed8)
+		self.shape = shape
+
+	# Show data between vmin and vmax with colormap number cmap
+	def setImage(self, data, vmin, vmax, cmap):
+		if self.shape != np.shape(data):
+			self.allocate(np.shape(data))
+
+		scaleToIndices(data, vmin, vmax, self.indices, self.scratch)
+		self.image.setColorTable(self.colorTables[cmap])
+		self.update()
+
+	def paintEvent(self, event):
+		if self.image is None:
+			return
+
+		# Fit the image in the widget, keeping square pixels
+		(h, w) = self.shape
+		scale = min(self.width()/float(w), self.height()/float(h))
+		target = QtCore.QRectF(0, 0, w*scale, h*scale)
+		target.moveCenter(QtCore.QRectF(self.rect()).center())
+
+		painter = QtGui.QPainter(self)
+		painter.drawImage(target, self.image)
+		painter.end()
@@ -0,0 +1,230 @@
+import os
+import time
+import json
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
+from twisted.python.failure import Failure
+
+from andor_helpers import *
+
+# Timings of the stages of one shot (acquisition loop)
+# Spans are (stage, start, end) in seconds since the epoch;
+# a stage can show up more than once, e.g. once for each image in the acquisition loop
+class Shot(object):
+	def __init__(self):
+		self.start = time.time()
+		self.spans = []
+		self.info = OrderedDict()
+		# Stages still running in other threads or waiting for the display, see ShotMetrics.hold
+		self.pending = 1
+
+	def add(self, stage, start, end):
+		self.spans.append((stage, start, end))
+
+	# Total time spent in each stage, in seconds
+	def totals(self):
+		totals = OrderedDict()
+		for (stage, start, end) in self.spans:
+			totals[stage] = totals.get(stage, 0) + end - start
+		return totals
+
+	# Compact log line: start time, info, and [stage, ms after start, ms] for each span
+	def toJson(self):
+		record = OrderedDict([('t', round(self.start, 3))])
+		record.update(self.info)
+		record['spans'] = [[stage, round(1000*(start - self.start), 2), round(1000*(end - start), 2)]
+			for (stage, start, end) in self.spans]
+		return json.dumps(record, separators=(',', ':'))
+
+# Per-shot stage timings
+#
+# The acquisition loop brackets each stage with start() and stop(), which go to the
+# shot being acquired. Saving and display finish after the next shot has started,
+# so the main window hold()s the shot for each of them and release()s it when they
+# are done. Once everything is released, the shot is added to the summary shown
+# in the GUI and queued for a rolling log of JSON lines next to the data.
+#
+# The log is on the save share, so it is written in batches of
+# KRBCAM_METRICS_FLUSH_SHOTS shots in a thread of its own (and when acquisition
+# stops, and on shutdown). While a batch is being written, its directory counts
+# as having a save pending in fileNumbers (a FileNumberIndex), so creating or
+# rolling over the log doesn't make the directory look changed.
+#
+# When disabled there is never a shot being acquired, so start() returns None
+# and the rest do nothing; nothing is timed or allocated.
+class ShotMetrics(object):
+	def __init__(self, reactor, enabled=KRBCAM_METRICS, fileNumbers=None):
+		self.reactor = reactor
+		self.enabled = enabled
+		self.fileNumbers = fileNumbers
+		self.current = None
+
+		# Total of each stage for the last KRBCAM_METRICS_WINDOW shots, in seconds
+		self.history = OrderedDict()
+
+		# Finished shots waiting to be logged, and the batch being written (a Deferred)
+		self.queue = []
+		self.flushing = None
+		self.closing = False
+
+		# Only used from the metrics thread
+		self.logFile = None
+		self.logPath = None
+
+		if self.enabled:
+			self.pool = ThreadPool(1, 1, "KRbCamMetrics")
+			self.pool.start()
+			# Write out what's left before the thread stops
+			self.reactor.addSystemEventTrigger('before', 'shutdown', self.close)
+			self.reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+
+	# Start timing a new shot; a shot that was never finished (aborted) is dropped
+	def beginShot(self):
+		if self.enabled:
+			self.current = Shot()
+
+	# Returns the start time of a span of the current shot, None if there is nothing to time
+	def start(self):
+		if self.current is None:
+			return None
+		return time.time()
+
+	# End a span of the current shot that began at start, at end (now if None)
+	def stop(self, stage, start, end=None):
+		self.span(self.current, stage, start, end)
+
+	# Add a span to shot, ending at end (now if None)
+	def span(self, shot, stage, start, end=None):
+		if shot is None or start is None:
+			return
+		if end is None:
+			end = time.time()
+		shot.add(stage, start, end)
+
+	# Keep the current shot open until release is called, and return it
+	def hold(self):
+		if self.current is not None:
+			self.current.pending += 1
+		return self.current
+
+	# Done acquiring the current shot
+	# info is logged with the shot, which is written to savedir once all holds are released
+	def endShot(self, savedir, info):
+		shot = self.current
+		self.current = None
+		if shot is not None:
+			shot.savedir = savedir
+			shot.info.update(info)
+		return self.release(shot)
+
+	# Release a hold on shot, adding a span from start to end first if start is given
+	# Returns True if that was the last hold and the shot was added to the summary
+	def release(self, shot, stage=None, start=None, end=None):
+		if shot is None:
+			return False
+		self.span(shot, stage, start, end)
+		shot.pending -= 1
+		if shot.pending:
+			return False
+
+		for (stage, total) in shot.totals().items():
+			if not self.history.has_key(stage):
+				self.history[stage] = deque(maxlen=KRBCAM_METRICS_WINDOW)
+			self.history[stage].append(total)
+
+		self.queue.append(shot)
+		if len(self.queue) >= KRBCAM_METRICS_FLUSH_SHOTS:
+			self.flush()
+		return True
+
+	# Write the queued shots to their logs in the metrics thread
+	# Returns a Deferred that fires once they are written, None if there was nothing to write
+	# Only one batch is written at a time; shots queued meanwhile go in the next one
+	def flush(self):
+		if self.flushing is not None or not self.queue:
+			return self.flushing
+		(shots, self.queue) = (self.queue, [])
+
+		dirs = set(shot.savedir for shot in shots)
+		if self.fileNumbers is not None:
+			for savedir in dirs:
+				self.fileNumbers.expectChange(savedir)
+
+		self.flushing = threads.deferToThreadPool(self.reactor, self.pool, self.writeLog, shots, self.closing)
+		self.flushing.addBoth(self.flushDone, dirs)
+		return self.flushing
+
+	def flushDone(self, result, dirs):
+		self.flushing = None
+		if self.fileNumbers is not None:
+			for savedir in dirs:
+				self.fileNumbers.published(savedir)
+		if isinstance(result, Failure):
+			print("Could not write shot metrics: {}".format(result.value))
+
+		# Keep going if a batch (or anything, when shutting down) built up meanwhile
+		if self.queue and (self.closing or len(self.queue) >= KRBCAM_METRICS_FLUSH_SHOTS):
+			return self.flush()
+
+	# Write everything that is left and close the log
+	def close(self):
+		self.closing = True
+		return self.flush()
+
+	# Runs in the metrics thread
+	# Append shots to the log in their save directories, closing the log afterwards if close
+	# The log is rolled over to .1 once it reaches KRBCAM_METRICS_LOG_MAX_BYTES
+	def writeLog(self, shots, close):
+		for shot in shots:
+			path = shot.savedir + KRBCAM_METRICS_LOG_FILE
+			try:
+				if path != self.logPath:
+					self.openLog(path)
+				elif self.logFile.tell() >= KRBCAM_METRICS_LOG_MAX_BYTES:
+					self.closeLog()
+					if os.path.exists(path + '.1'):
+						os.remove(path + '.1')
+					os.rename(path, path + '.1')
+					self.openLog(path)
+
+				self.logFile.write(shot.toJson() + '\n')
+			except (IOError, OSError) as e:
+				print("Could not write shot metrics: {}".format(e))
+				self.closeLog()
+
+		try:
+			if close:
+				self.closeLog()
+			elif self.logFile is not None:
+				self.logFile.flush()
+		except (IOError, OSError) as e:
+			print("Could not write shot metrics: {}".format(e))
+			self.closeLog()
+
+	def openLog(self, path):
+		self.closeLog()
+		self.logFile = open(path, 'a')
+		# Files opened for appending don't always start out at the end
+		self.logFile.seek(0, os.SEEK_END)
+		self.logPath = path
+
+	def closeLog(self):
+		if self.logFile is not None:
+			try:
+				self.logFile.close()
+			except (IOError, OSError):
+				pass
+		self.logFile = None
+		self.logPath = None
+
+	# (stage, last, mean, 95th percentile) of the stage totals, in ms
+	def summary(self):
+		rows = []
+		for (stage, totals) in self.history.items():
+			t = 1000*np.array(totals)
+			rows.append((stage, t[-1], t.mean(), np.percentile(t, 95)))
+		return rows
@@ -0,0 +1,91 @@
+import numpy as np
+
+from twisted.internet import threads, defer
+from twisted.python.threadpool import ThreadPool
+
+from andor_helpers import *
+from image_processing import ODEngine, rotateFrames, percentileLimits
+
+# Prepares shots for display in a background thread
+#
+# For each shot, the frames are rotated into display orientation, and the OD
+# images and their autoscale limits are calculated for the frames selected in
+# each setting of the image window. The main thread only has to draw the result.
+#
+# Latest wins: while one shot is being processed, only the newest shot waits
+# to go next. Older waiting shots are skipped, so a slow display never holds
+# up acquisition (saving doesn't go through here, so no data is lost).
+class ShotProcessor(object):
+	def __init__(self, reactor):
+		self.reactor = reactor
+
+		# Only used from the processing thread
+		self.odEngine = ODEngine()
+
+		self.busy = False
+		# (Deferred, args) of the shot waiting to be processed
+		self.next = None
+		# Number of shots that were skipped, since the count was last reset
+		self.dropped = 0
+
+		self.pool = ThreadPool(1, 1, "KRbCamProcessing")
+		self.pool.start()
+		self.reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+
+	# data is the run buffer, indexed by (acquisition loop frame, FK frame, row, column)
+	# selections is a list of (setting, (shadow, light, dark)) frame indices to calculate ODs for
+	#
+	# Returns a Deferred that fires with (frames, ods, limits), see processShot,
+	# or with None if a newer shot came in before this one was started
+	def process(self, data, rotate, selections):
+		d = defer.Deferred()
+		if self.busy:
+			if self.next is not None:
+				self.dropped += 1
+				self.next[0].callback(None)
+			self.next = (d, (data, rotate, selections))
+		else:
+			self.start(d, (data, rotate, selections))
+		return d
+
+	# Returns the number of shots skipped for newer ones and resets the count
+	def getDropped(self):
+		dropped = self.dropped
+		self.dropped = 0
+		return dropped
+
+	def start(self, d, args):
+		self.busy = True
+		work = threads.deferToThreadPool(self.reactor, self.pool, self.processShot, *args)
+		work.addBoth(self.processDone)
+		work.chainDeferred(d)
+
+	def processDone(self, result):
+		self.busy = False
+		if self.next is not None:
+			(d, args) = self.next
+			self.next = None
+			self.start(d, args)
+		return result
+
+	# Runs in the processing thread
+	# Returns the frames in display orientation, and dicts of OD images
+	# and OD autoscale limits keyed by (setting, (shadow, light, dark))
+	def processShot(self, data, rotate, selections):
+		if rotate:
+			data = rotateFrames(data)
+		frames = np.ascontiguousarray(data)
+
+		ods = {}
+		limits = {}
+		for (setting, config) in selections:
+			try:
+				(shadow, light, dark) = [frames[i0, i1] for (i0, i1) in config]
+			# The selection is from a run with more frames
+			except IndexError:
+				continue
+			od = self.odEngine.calcOD(shadow, light, dark)
+			ods[(setting, config)] = od
+			limits[(setting, config)] = percentileLimits(od)
+
+		return (frames, ods, limits)
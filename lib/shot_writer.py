@@ -0,0 +1,113 @@
+import os
+import time
+import json
+
+import numpy as np
+
+from twisted.internet import threads, defer
+from twisted.python.threadpool import ThreadPool
+from twisted.python.failure import Failure
+
+from andor_helpers import *
+
+# Publish a finished file
+# Files are written to path_temp first and only renamed to path once complete
+# Otherwise, fitting program autoloads the file before writing is complete
+# Returns the time the rename took, in seconds (it can be slow on the network share)
+def publish(path_temp, path):
+	start = time.time()
+	os.rename(path_temp, path)
+	return time.time() - start
+
+# The write functions return the time taken by publish
+
+# Write a run as a compressed .npz file
+# frames are ordered by FK frame first, shape is the shape saved to the file
+def writeNpz(path_temp, path, frames, shape, metadata):
+	with open(path_temp, 'wb') as f:
+		np.savez_compressed(f, data=frames.reshape(shape), meta=metadata)
+	return publish(path_temp, path)
+
+# Write a run as an uncompressed .npy file, which can be memory-mapped,
+# with the metadata in a .json sidecar next to it
+# The sidecar is published first, so it is always there once the .npy shows up
+def writeNpy(path_temp, path, frames, shape, metadata):
+	meta_temp = os.path.splitext(path_temp)[0] + '.json'
+	meta_path = os.path.splitext(path)[0] + '.json'
+	with open(meta_temp, 'w') as f:
+		json.dump(metadata, f)
+	published = publish(meta_temp, meta_path)
+
+	with open(path_temp, 'wb') as f:
+		np.save(f, frames.reshape(shape))
+	return published + publish(path_temp, path)
+
+# Write a run as a .csv file
+# The frames are written one after another, without stacking them into one array first
+def writeCsv(path_temp, path, frames):
+	with open(path_temp, 'w') as f:
+		for fk in frames:
+			for frame in fk:
+				np.savetxt(f, frame, fmt='%d', delimiter=',')
+	return publish(path_temp, path)
+
+# Background writer for saving shots
+#
+# Writes run in a small thread pool, so compression and the network share
+# don't block the GUI or delay re-arming the camera.
+# The number of pending writes is bounded: when the queue is full, whenReady()
+# returns a Deferred that fires once a write finishes, and the acquisition loop
+# waits on it instead of dropping shots.
+class ShotWriter(object):
+	def __init__(self, reactor, maxPending=KRBCAM_SAVE_QUEUE_LENGTH, nThreads=KRBCAM_SAVE_THREADS):
+		self.reactor = reactor
+		self.maxPending = maxPending
+
+		# Number of writes submitted but not finished
+		self.pending = 0
+		# Duration of the last finished write, in seconds
+		self.lastLatency = 0
+
+		# Deferreds waiting for space in the queue
+		self.waiting = []
+
+		# Queued writes are finished before the pool stops
+		self.pool = ThreadPool(1, nThreads, "KRbCamWriter")
+		self.pool.start()
+		self.reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+
+	# Queue write(*args) in the writer thread
+	# Returns a Deferred that fires with (write time, time spent publishing) in seconds
+	def submit(self, write, *args):
+		self.pending += 1
+		d = threads.deferToThreadPool(self.reactor, self.pool, self.timedWrite, write, *args)
+		d.addBoth(self.writeDone)
+		return d
+
+	# Runs in the writer thread
+	def timedWrite(self, write, *args):
+		start = time.time()
+		published = write(*args)
+		return (time.time() - start, published)
+
+	def writeDone(self, result):
+		self.pending -= 1
+		if not isinstance(result, Failure):
+			self.lastLatency = result[0]
+
+		# Let the acquisition loop continue if it was held up
+		while self.waiting and not self.isFull():
+			self.waiting.pop(0).callback(None)
+
+		return result
+
+	def isFull(self):
+		return self.pending >= self.maxPending
+
+	# Returns a Deferred that fires once there is space in the queue
+	def whenReady(self):
+		if not self.isFull():
+			return defer.succeed(None)
+		d = defer.Deferred()
+		self.waiting.append(d)
+		return d
@@ -0,0 +1,611 @@
+import time
+import threading
+
+import numpy as np
+
+from andor_helpers import *
+
+# Simulated iXon, standing in for the atmcd.py wrapper of the Andor SDK
+#
+# Has the SDK calls that KRbiXon and the main GUI make, with the same arguments
+# and return values, so the whole acquisition, readout, save and display
+# pipeline runs without a camera. Used instead of atmcd when KRBCAM_SIMULATE is set.
+#
+# Timing follows the settings: an acquisition starts on the next external trigger
+# (every KRBCAM_SIM_TRIGGER_PERIOD seconds) or right away with the internal trigger,
+# then takes the exposure time(s) plus a readout time from the shift speeds and image size.
+# Images are synthetic absorption images: consecutive acquisitions cycle through
+# shadow (atoms), light and dark, like the frames of an OD series.
+
+# Detector of the simulated camera (an iXon 888)
+SIM_HEAD_MODEL = 'DU888_BV'
+SIM_DETECTOR = (1024, 1024)					# (x, y) pixels
+SIM_TEMPERATURE_RANGE = (-95, 20)			# Celsius
+SIM_SHUTTER_MIN_TIMES = (27, 27)			# ms, (closing, opening)
+SIM_SOFTWARE_VERSION = (0, 0, 0, 0, 2, 104)	# EPROM, COF file, driver rev., driver ver., DLL rev., DLL ver.
+SIM_VS_SPEEDS = [0.6, 1.13, 2.2, 4.33]		# us
+SIM_FK_VS_SPEEDS = [0.6, 1.13, 2.2, 4.33]	# us
+SIM_HS_SPEEDS = [[30.0, 20.0, 10.0, 1.0], [1.0, 0.1]]	# MHz, (EM, conventional) amplifier
+SIM_PREAMP_GAINS = [1.0, 2.0]
+SIM_FIRST_HANDLE = 100
+
+SIM_BIAS = 100								# Counts of the dark frames
+SIM_READ_NOISE = 8							# Counts
+SIM_LIGHT_COUNTS = 1500						# Counts at the center of the probe beam
+SIM_PEAK_OD = 1.5
+SIM_COOLING_TIME = 10.0						# s, time constant of the temperature
+SIM_AMBIENT_TEMP = 20.0						# Celsius
+SIM_BUFFER_LENGTH = 32						# Images the circular buffer holds in Run till Abort
+
+# Capabilities structure, as filled in by GetCapabilities
+class AndorCapabilities(object):
+	def __init__(self):
+		self.ulSize = 0
+		self.ulAcqModes = 0
+		self.ulReadModes = 0
+		self.ulTriggerModes = 0
+		self.ulCameraType = 0
+		self.ulPixelMode = 0
+		self.ulSetFunctions = 0
+		self.ulGetFunctions = 0
+		self.ulFeatures = 0
+		self.ulPCICard = 0
+		self.ulEMGainCapability = 0
+		self.ulFTReadModes = 0
+
+# Stands in for the ctypes library, for the calls that KRbiXon makes on it directly
+# Arguments are ctypes objects, the same as for the real library
+class SimulatedDLL(object):
+	def __init__(self, camera):
+		self.camera = camera
+
+	def GetImages(self, first, last, arr, size, validfirst, validlast):
+		return self.camera.readImages(first.value, last.value, np.ctypeslib.as_array(arr, shape=(size.value,)), validfirst._obj, validlast._obj)
+
+	def GetImages16(self, first, last, arr, size, validfirst, validlast):
+		return self.camera.readImages(first.value, last.value, np.ctypeslib.as_array(arr, shape=(size.value,)), validfirst._obj, validlast._obj)
+
+	def GetOldestImage(self, arr, size):
+		return self.camera.readOldestImage(np.ctypeslib.as_array(arr, shape=(size.value,)))
+
+	def GetOldestImage16(self, arr, size):
+		return self.camera.readOldestImage(np.ctypeslib.as_array(arr, shape=(size.value,)))
+
+class atmcd(object):
+	# Error codes, same values as atmcd.h
+	DRV_ERROR_CODES = 20001
+	DRV_SUCCESS = 20002
+	DRV_VXDNOTINSTALLED = 20003
+	DRV_ERROR_FILELOAD = 20006
+	DRV_ERROR_PAGELOCK = 20010
+	DRV_ERROR_ACK = 20013
+	DRV_NO_NEW_DATA = 20024
+	DRV_TEMP_OFF = 20034
+	DRV_TEMP_NOT_STABILIZED = 20035
+	DRV_TEMP_STABILIZED = 20036
+	DRV_TEMP_NOT_REACHED = 20037
+	DRV_TEMP_DRIFT = 20040
+	DRV_FLEXERROR = 20053
+	DRV_P1INVALID = 20066
+	DRV_P2INVALID = 20067
+	DRV_P3INVALID = 20068
+	DRV_P4INVALID = 20069
+	DRV_INIERROR = 20070
+	DRV_COFERROR = 20071
+	DRV_ACQUIRING = 20072
+	DRV_IDLE = 20073
+	DRV_NOT_INITIALIZED = 20075
+	DRV_P5INVALID = 20076
+	DRV_P6INVALID = 20077
+	DRV_P7INVALID = 20083
+	DRV_USBERROR = 20089
+	DRV_ERROR_NOCAMERA = 20990
+
+	def __init__(self):
+		self.dll = SimulatedDLL(self)
+
+		# One simulated camera for each camera in serials.json
+		self.serials = sorted(int(s) for s in getSerials().keys())
+		self.handle = None
+		self.initialized = False
+
+		# Arguments of the last call of each setter, keyed by setter name
+		self.settings = {}
+
+		# Acquisition state, guarded by the condition,
+		# which also wakes up WaitForAcquisitionTimeOut
+		self.condition = threading.Condition()
+		self.acquiring = False
+		# Start and end times of the acquisitions still to come, in time.time() seconds
+		self.schedule = []
+		# Acquisition events not yet collected by WaitForAcquisitionTimeOut
+		self.events = 0
+		self.waiting = False
+		self.cancelled = False
+		# Trigger and end times of the last acquisition that finished, for benchmarking
+		self.lastTrigger = None
+		self.lastDone = None
+
+		# Images of the last single or fast kinetics acquisition,
+		# or the circular buffer in Run till Abort
+		self.images = []
+		self.buffer = []
+
+		# Position in the shadow, light, dark cycle
+		self.shotCounter = 0
+		# Synthetic frames, keyed by (kind, shape, FK frame)
+		self.frames = {}
+
+		self.triggerStart = time.time()
+		self.coolerOn = False
+		self.targetTemp = KRBCAM_DEFAULT_TEMP
+		self.temperature = SIM_AMBIENT_TEMP
+		self.temperatureTime = time.time()
+
+	###################
+	## Camera select ##
+	###################
+
+	def GetAvailableCameras(self):
+		return (self.DRV_SUCCESS, len(self.serials))
+
+	def GetCameraHandle(self, index):
+		if index < 0 or index >= len(self.serials):
+			return (self.DRV_P1INVALID, -1)
+		return (self.DRV_SUCCESS, SIM_FIRST_HANDLE + index)
+
+	def SetCurrentCamera(self, handle):
+		if handle - SIM_FIRST_HANDLE not in range(len(self.serials)):
+			return self.DRV_P1INVALID
+		self.handle = handle
+		return self.DRV_SUCCESS
+
+	def Initialize(self, directory):
+		if self.handle is None:
+			self.handle = SIM_FIRST_HANDLE
+		self.initialized = True
+		self.settings = {}
+		self.triggerStart = time.time()
+		return self.DRV_SUCCESS
+
+	def ShutDown(self):
+		with self.condition:
+			self.acquiring = False
+			self.schedule = []
+		self.initialized = False
+		return self.DRV_SUCCESS
+
+	def GetCameraSerialNumber(self):
+		if not self.initialized:
+			return (self.DRV_NOT_INITIALIZED, 0)
+		return (self.DRV_SUCCESS, self.serials[self.handle - SIM_FIRST_HANDLE])
+
+	#######################
+	## Camera properties ##
+	#######################
+
+	def GetCapabilities(self):
+		return (self.DRV_SUCCESS, AndorCapabilities())
+
+	def GetHeadModel(self):
+		return (self.DRV_SUCCESS, SIM_HEAD_MODEL)
+
+	def GetSoftwareVersion(self):
+		return (self.DRV_SUCCESS,) + SIM_SOFTWARE_VERSION
+
+	def GetDetector(self):
+		return (self.DRV_SUCCESS, SIM_DETECTOR[0], SIM_DETECTOR[1])
+
+	def IsInternalMechanicalShutter(self):
+		return (self.DRV_SUCCESS, 1)
+
+	def GetShutterMinTimes(self):
+		return (self.DRV_SUCCESS, SIM_SHUTTER_MIN_TIMES[0], SIM_SHUTTER_MIN_TIMES[1])
+
+	def GetTemperatureRange(self):
+		return (self.DRV_SUCCESS, SIM_TEMPERATURE_RANGE[0], SIM_TEMPERATURE_RANGE[1])
+
+	def GetNumberVSSpeeds(self):
+		return (self.DRV_SUCCESS, len(SIM_VS_SPEEDS))
+
+	def GetVSSpeed(self, index):
+		return (self.DRV_SUCCESS, SIM_VS_SPEEDS[index])
+
+	def GetNumberFKVShiftSpeeds(self):
+		return (self.DRV_SUCCESS, len(SIM_FK_VS_SPEEDS))
+
+	def GetFKVShiftSpeedF(self, index):
+		return (self.DRV_SUCCESS, SIM_FK_VS_SPEEDS[index])
+
+	def GetNumberADChannels(self):
+		return (self.DRV_SUCCESS, 1)
+
+	def GetNumberHSSpeeds(self, channel, typ):
+		return (self.DRV_SUCCESS, len(SIM_HS_SPEEDS[typ]))
+
+	def GetHSSpeed(self, channel, typ, index):
+		return (self.DRV_SUCCESS, SIM_HS_SPEEDS[typ][index])
+
+	def GetNumberPreAmpGains(self):
+		return (self.DRV_SUCCESS, len(SIM_PREAMP_GAINS))
+
+	def GetPreAmpGain(self, index):
+		return (self.DRV_SUCCESS, SIM_PREAMP_GAINS[index])
+
+	def IsPreAmpGainAvailable(self, channel, amplifier, index, pa):
+		return (self.DRV_SUCCESS, 1)
+
+	def GetEMGainRange(self):
+		if self.settings.get('SetEMAdvanced', (0,))[0]:
+			return (self.DRV_SUCCESS, 1, 1000)
+		return (self.DRV_SUCCESS, 1, 300)
+
+	##############
+	## Settings ##
+	##############
+
+	# Remember the arguments of a setter
+	def store(self, name, args):
+		self.settings[name] = args
+		return self.DRV_SUCCESS
+
+	def SetFanMode(self, mode):
+		return self.store('SetFanMode', (mode,))
+
+	def SetReadMode(self, mode):
+		return self.store('SetReadMode', (mode,))
+
+	def SetAcquisitionMode(self, mode):
+		return self.store('SetAcquisitionMode', (mode,))
+
+	def SetShutter(self, typ, mode, closingTime, openingTime):
+		return self.store('SetShutter', (typ, mode, closingTime, openingTime))
+
+	def SetTriggerMode(self, mode):
+		return self.store('SetTriggerMode', (mode,))
+
+	def SetFastExtTrigger(self, mode):
+		return self.store('SetFastExtTrigger', (mode,))
+
+	def SetEMGainMode(self, mode):
+		return self.store('SetEMGainMode', (mode,))
+
+	def SetEMAdvanced(self, state):
+		return self.store('SetEMAdvanced', (state,))
+
+	def SetOutputAmplifier(self, typ):
+		return self.store('SetOutputAmplifier', (typ,))
+
+	def SetEMCCDGain(self, gain):
+		return self.store('SetEMCCDGain', (gain,))
+
+	def SetADChannel(self, channel):
+		return self.store('SetADChannel', (channel,))
+
+	def SetHSSpeed(self, typ, index):
+		if index >= len(SIM_HS_SPEEDS[typ]):
+			return self.DRV_P2INVALID
+		return self.store('SetHSSpeed', (typ, index))
+
+	def SetPreAmpGain(self, index):
+		return self.store('SetPreAmpGain', (index,))
+
+	def SetVSSpeed(self, index):
+		if index >= len(SIM_VS_SPEEDS):
+			return self.DRV_P1INVALID
+		return self.store('SetVSSpeed', (index,))
+
+	def SetFKVShiftSpeed(self, index):
+		if index >= len(SIM_FK_VS_SPEEDS):
+			return self.DRV_P1INVALID
+		return self.store('SetFKVShiftSpeed', (index,))
+
+	def SetFastKineticsEx(self, exposedRows, seriesLength, exposure, mode, hbin, vbin, offset):
+		return self.store('SetFastKineticsEx', (exposedRows, seriesLength, exposure, mode, hbin, vbin, offset))
+
+	def SetExposureTime(self, exposure):
+		return self.store('SetExposureTime', (exposure,))
+
+	def SetKineticCycleTime(self, cycle):
+		return self.store('SetKineticCycleTime', (cycle,))
+
+	def SetImage(self, hbin, vbin, hstart, hend, vstart, vend):
+		return self.store('SetImage', (hbin, vbin, hstart, hend, vstart, vend))
+
+	def SetImageRotate(self, rotate):
+		return self.store('SetImageRotate', (rotate,))
+
+	def SetImageFlip(self, hflip, vflip):
+		return self.store('SetImageFlip', (hflip, vflip))
+
+	#############
+	## Timings ##
+	#############
+
+	def acquisitionMode(self):
+		return self.settings.get('SetAcquisitionMode', (KRBCAM_ACQ_MODE_SINGLE,))[0]
+
+	def exposureTime(self):
+		if self.acquisitionMode() == KRBCAM_ACQ_MODE_FK:
+			return self.settings.get('SetFastKineticsEx', (0, 1, 0.0))[2]
+		return self.settings.get('SetExposureTime', (0.0,))[0]
+
+	# Number of frames and (rows, columns) of each frame, before any rotation
+	def frameGeometry(self):
+		if self.acquisitionMode() == KRBCAM_ACQ_MODE_FK:
+			(rows, series, exp, mode, hbin, vbin, offset) = self.settings.get('SetFastKineticsEx', (KRBCAM_EXPOSED_ROWS, 1, 0.0, 4, 1, 1, 0))
+			return (series, (rows//vbin, SIM_DETECTOR[0]//hbin))
+		(hbin, vbin, hstart, hend, vstart, vend) = self.settings.get('SetImage', (1, 1, 1, SIM_DETECTOR[0], 1, SIM_DETECTOR[1]))
+		return (1, ((vend - vstart + 1)//vbin, (hend - hstart + 1)//hbin))
+
+	# Time to read out the frames: shift every row of the sensor down, and digitize the frames
+	def readoutTime(self):
+		(n, (rows, cols)) = self.frameGeometry()
+		vss = SIM_VS_SPEEDS[self.settings.get('SetVSSpeed', (0,))[0]]
+		(typ, index) = self.settings.get('SetHSSpeed', (1, 0))
+		hss = SIM_HS_SPEEDS[typ][index]
+		return SIM_DETECTOR[1]*vss*1e-6 + n*rows*cols/(hss*1e6)
+
+	# Time from the trigger until the image(s) are exposed
+	# In fast kinetics, each frame is exposed and then shifted down under the mask
+	def exposureDuration(self):
+		exposure = self.exposureTime()
+		if self.acquisitionMode() == KRBCAM_ACQ_MODE_FK:
+			(exposedRows, series) = self.settings.get('SetFastKineticsEx', (KRBCAM_EXPOSED_ROWS, 1))[:2]
+			fkvss = SIM_FK_VS_SPEEDS[self.settings.get('SetFKVShiftSpeed', (0,))[0]]
+			return series*(exposure + exposedRows*fkvss*1e-6)
+		return exposure
+
+	def GetAcquisitionTimings(self):
+		exposure = self.exposureTime()
+		cycle = max(self.settings.get('SetKineticCycleTime', (0,))[0], self.exposureDuration() + self.readoutTime())
+		return (self.DRV_SUCCESS, exposure, exposure, cycle)
+
+	def GetFKExposureTime(self):
+		return (self.DRV_SUCCESS, self.exposureTime())
+
+	def GetKeepCleanTime(self):
+		return (self.DRV_SUCCESS, SIM_DETECTOR[1]*SIM_VS_SPEEDS[0]*1e-6)
+
+	def GetReadOutTime(self):
+		return (self.DRV_SUCCESS, self.readoutTime())
+
+	#################
+	## Temperature ##
+	#################
+
+	# Relax the temperature towards the set point (cooler on) or ambient (cooler off)
+	def updateTemperature(self):
+		now = time.time()
+		target = self.targetTemp if self.coolerOn else SIM_AMBIENT_TEMP
+		self.temperature = target + (self.temperature - target)*np.exp(-(now - self.temperatureTime)/SIM_COOLING_TIME)
+		self.temperatureTime = now
+
+	def CoolerON(self):
+		self.updateTemperature()
+		self.coolerOn = True
+		return self.DRV_SUCCESS
+
+	def CoolerOFF(self):
+		self.updateTemperature()
+		self.coolerOn = False
+		return self.DRV_SUCCESS
+
+	def SetTemperature(self, temperature):
+		if temperature < SIM_TEMPERATURE_RANGE[0] or temperature > SIM_TEMPERATURE_RANGE[1]:
+			return self.DRV_P1INVALID
+		self.updateTemperature()
+		self.targetTemp = temperature
+		return self.DRV_SUCCESS
+
+	def GetTemperature(self):
+		if not self.initialized:
+			return (self.DRV_NOT_INITIALIZED, 0)
+		self.updateTemperature()
+		temperature = int(round(self.temperature))
+		if not self.coolerOn:
+			return (self.DRV_TEMP_OFF, temperature)
+		elif abs(self.temperature - self.targetTemp) < 0.5:
+			return (self.DRV_TEMP_STABILIZED, temperature)
+		return (self.DRV_TEMP_NOT_REACHED, temperature)
+
+	#################
+	## Acquisition ##
+	#################
+
+	# First trigger at or after t
+	def nextTrigger(self, t):
+		if self.settings.get('SetTriggerMode', (0,))[0] == 0:
+			return t
+		period = KRBCAM_SIM_TRIGGER_PERIOD
+		return self.triggerStart + np.ceil((t - self.triggerStart)/period)*period
+
+	# Schedule the acquisition starting on the first trigger after t
+	# Only called with the condition held
+	def scheduleAcquisition(self, t):
+		start = self.nextTrigger(t)
+		self.schedule.append((start, start + self.exposureDuration() + self.readoutTime()))
+
+	# Collect the acquisitions that have finished by now
+	# Only called with the condition held
+	def update(self):
+		now = time.time()
+		stream = self.acquisitionMode() == KRBCAM_ACQ_MODE_STREAM
+		while self.acquiring and self.schedule and self.schedule[0][1] <= now:
+			(start, end) = self.schedule.pop(0)
+			self.events += 1
+			(self.lastTrigger, self.lastDone) = (start, end)
+
+			if stream:
+				self.buffer.append(self.makeShot()[0])
+				del self.buffer[:-SIM_BUFFER_LENGTH]
+				# The next image starts on the next trigger after this one is read out
+				self.scheduleAcquisition(max(end, start + self.settings.get('SetKineticCycleTime', (0,))[0]))
+			else:
+				self.images = self.makeShot()
+				self.acquiring = False
+
+	def StartAcquisition(self):
+		with self.condition:
+			self.update()
+			if self.acquiring:
+				return self.DRV_ACQUIRING
+			self.acquiring = True
+			self.schedule = []
+			self.events = 0
+			self.images = []
+			self.buffer = []
+			self.scheduleAcquisition(time.time())
+		return self.DRV_SUCCESS
+
+	def AbortAcquisition(self):
+		with self.condition:
+			self.update()
+			if not self.acquiring:
+				return self.DRV_IDLE
+			self.acquiring = False
+			self.schedule = []
+			# A new acquisition loop starts from the shadow frame again
+			self.shotCounter = 0
+			self.condition.notify_all()
+		return self.DRV_SUCCESS
+
+	def GetStatus(self):
+		with self.condition:
+			self.update()
+			if self.acquiring:
+				return (self.DRV_SUCCESS, self.DRV_ACQUIRING)
+			return (self.DRV_SUCCESS, self.DRV_IDLE)
+
+	# Block until an acquisition event, the timeout (in ms) or CancelWait
+	# Events that happened before the call are returned right away, like the SDK's event
+	def WaitForAcquisitionTimeOut(self, timeout):
+		deadline = time.time() + timeout*1e-3
+		with self.condition:
+			self.waiting = True
+			try:
+				while True:
+					self.update()
+					if self.events:
+						self.events -= 1
+						return self.DRV_SUCCESS
+					if self.cancelled:
+						self.cancelled = False
+						return self.DRV_NO_NEW_DATA
+
+					now = time.time()
+					if now >= deadline:
+						return self.DRV_NO_NEW_DATA
+					wait = deadline - now
+					if self.acquiring and self.schedule:
+						wait = min(wait, max(self.schedule[0][1] - now, 0))
+					self.condition.wait(wait)
+			finally:
+				self.waiting = False
+
+	def CancelWait(self):
+		with self.condition:
+			if self.waiting:
+				self.cancelled = True
+				self.condition.notify_all()
+		return self.DRV_SUCCESS
+
+	def GetNumberAvailableImages(self):
+		with self.condition:
+			self.update()
+			if self.acquisitionMode() == KRBCAM_ACQ_MODE_STREAM:
+				n = len(self.buffer)
+			else:
+				n = len(self.images)
+		if n == 0:
+			return (self.DRV_NO_NEW_DATA, 0, 0)
+		return (self.DRV_SUCCESS, 1, n)
+
+	# Copy images first to last (1-based) of the last acquisition into out, a flat array
+	def readImages(self, first, last, out, validfirst, validlast):
+		with self.condition:
+			self.update()
+			images = self.images[first - 1:last]
+		if not images:
+			return self.DRV_NO_NEW_DATA
+		if out.size != sum(i.size for i in images):
+			return self.DRV_P4INVALID
+
+		self.copyImages(images, out)
+		validfirst.value = first
+		validlast.value = first + len(images) - 1
+		return self.DRV_SUCCESS
+
+	# Take the oldest image in the circular buffer (Run till Abort) and copy it into out, a flat array
+	def readOldestImage(self, out):
+		with self.condition:
+			self.update()
+			if not self.buffer:
+				return self.DRV_NO_NEW_DATA
+			image = self.buffer[0]
+			if out.size != image.size:
+				return self.DRV_P2INVALID
+			self.buffer.pop(0)
+		self.copyImages([image], out)
+		return self.DRV_SUCCESS
+
+	# Counts are clipped to the range of the output, like the 16-bit readout
+	def copyImages(self, images, out):
+		info = np.iinfo(out.dtype)
+		offset = 0
+		for image in images:
+			out[offset:offset + image.size] = np.clip(image.ravel(), info.min, info.max)
+			offset += image.size
+
+	######################
+	## Synthetic images ##
+	######################
+
+	# The frames of the next shot, in the order they come off the camera
+	def makeShot(self):
+		kind = ['shadow', 'light', 'dark'][self.shotCounter % 3]
+		self.shotCounter += 1
+
+		(n, shape) = self.frameGeometry()
+		frames = [self.makeFrame(kind, shape, i) for i in range(n)]
+
+		rotate = self.settings.get('SetImageRotate', (0,))[0]
+		(hflip, vflip) = self.settings.get('SetImageFlip', (0, 0))
+		for i in range(n):
+			if hflip:
+				frames[i] = frames[i][:, ::-1]
+			if vflip:
+				frames[i] = frames[i][::-1]
+			if rotate == 1:
+				frames[i] = np.rot90(frames[i], -1)
+			elif rotate == 2:
+				frames[i] = np.rot90(frames[i], 1)
+		return frames
+
+	# One frame of the given kind, with noise
+	# A few noise realizations of each frame are made once and reused, so making a shot costs nothing
+	def makeFrame(self, kind, shape, index):
+		key = (kind, shape, index)
+		if not self.frames.has_key(key):
+			self.frames[key] = [self.synthesizeFrame(kind, shape, index) for i in range(KRBCAM_SIM_NOISE_FRAMES)]
+		variants = self.frames[key]
+		return variants[self.shotCounter // 3 % len(variants)]
+
+	# Absorption imaging: a Gaussian probe beam on top of the bias,
+	# and for the shadow frame a cloud with a Gaussian OD profile in front of it
+	# Each FK frame (species) has its cloud in a different place
+	def synthesizeFrame(self, kind, shape, index):
+		(rows, cols) = shape
+		(y, x) = np.mgrid[0:rows, 0:cols].astype(np.float32)
+		frame = np.random.normal(SIM_BIAS, SIM_READ_NOISE, shape).astype(np.float32)
+		if kind == 'dark':
+			return frame.astype(np.int32)
+
+		beam = SIM_LIGHT_COUNTS*np.exp(-((x - cols/2.0)**2/(2*(cols/3.0)**2) + (y - rows/2.0)**2/(2*(rows/3.0)**2)))
+		if kind == 'shadow':
+			(x0, y0) = (cols*(0.4 + 0.2*(index % 2)), rows*(0.5 - 0.1*(index % 2)))
+			(sx, sy) = (cols/10.0, rows/12.0)
+			od = SIM_PEAK_OD*np.exp(-((x - x0)**2/(2*sx**2) + (y - y0)**2/(2*sy**2)))
+			beam *= np.exp(-od)
+		frame += np.random.poisson(beam)
+		return frame.astype(np.int32)